@@ -1,11 +1,20 @@
 import os
 import io
 import json
+import gzip
+import orjson
+import time
+import hashlib
+from collections import OrderedDict
 import boto3
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+from pyarrow import json as pajson
+from pyarrow import csv as pacsv
 from datetime import timedelta, datetime, date
 import urllib.parse
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 # --- Environment Variables ---
@@ -20,100 +29,185 @@ PRICE_S3_PREFIX = "stooq/daily/"
 NEWS_S3_PREFIX = "gdelt/news/"
 LOOKBACK_DAYS_PRICE = 250 # History needed for price features
 LOOKBACK_DAYS_NEWS_ROLLING = 5 # History needed for rolling news features
-
-# --- AWS Clients ---
-s3_client = boto3.client("s3")
-dynamodb = boto3.resource("dynamodb", region_name=REGION)
+MISSING_OBJECT_CODES = ('NoSuchKey', 'AccessDenied') # Without s3:ListBucket a missing key is AccessDenied
+PRICE_CSV_COLUMN_TYPES = { # Stooq header -> parsed type (date comes back typed, no pd.to_datetime)
+    'Date': pa.timestamp('ns'), 'Open': pa.float32(), 'High': pa.float32(),
+    'Low': pa.float32(), 'Close': pa.float32(), 'Volume': pa.float32() # float32 halves bytes moved; model consumes float32
+}
+
+# --- JIT (numba if bundled, else the kernels run as plain Python) ---
+os.environ.setdefault('NUMBA_CACHE_DIR', '/tmp/numba_cache') # Deployment package is read-only
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]): return args[0]
+        return lambda fn: fn
+
+# --- AWS Clients (shared config: pooled keep-alive connections, adaptive retries) ---
+BOTO_CONFIG = Config(retries={'mode': 'adaptive', 'max_attempts': 3}, max_pool_connections=32, tcp_keepalive=True)
+s3_client = boto3.client("s3", config=BOTO_CONFIG)
+dynamodb = boto3.resource("dynamodb", region_name=REGION, config=BOTO_CONFIG)
 table = dynamodb.Table(DDB_TABLE)
-comprehend = boto3.client("comprehend", region_name=REGION)
+comprehend = boto3.client("comprehend", region_name=REGION, config=BOTO_CONFIG)
 
 # --- Helper: Get Sentiment ---
-def get_sentiment_score(text):
-    """Analyzes text using Amazon Comprehend"""
-    if not text or not isinstance(text, str): return 0.0
-    try:
-        truncated_text = text[:4900]
-        response = comprehend.detect_sentiment(Text=truncated_text, LanguageCode='en')
-        sentiment = response['Sentiment']
-        if sentiment == 'POSITIVE': return 1.0
-        elif sentiment == 'NEGATIVE': return -1.0
-        else: return 0.0 # NEUTRAL or MIXED
-    except ClientError as e: return 0.0 # Treat Comprehend errors as neutral
-    except Exception as e: return 0.0 # Treat other errors as neutral
+COMPREHEND_BATCH_SIZE = 25 # BatchDetectSentiment per-request document limit
+SENTIMENT_SCORES = {'POSITIVE': 1.0, 'NEGATIVE': -1.0} # NEUTRAL or MIXED -> 0.0
+SENTIMENT_CACHE_MAX = 4096
+_SENTIMENT_CACHE = OrderedDict() # {blake2b(normalized title): score}, survives warm invocations
+
+def _title_hash(title):
+    return hashlib.blake2b(title.strip().lower().encode('utf-8'), digest_size=16).digest()
+
+def get_sentiment_scores(titles):
+    """
+    Analyzes a list of titles using Amazon Comprehend in batches of 25. Returns a float32 array, one score per title.
+    Repeated (e.g. syndicated) titles are served from a process-local cache and sent at most once.
+    """
+    hashes = [_title_hash(t) for t in titles]
+    pending = {} # hash -> text, only titles not already cached
+    for h, t in zip(hashes, titles):
+        if h in _SENTIMENT_CACHE: _SENTIMENT_CACHE.move_to_end(h)
+        elif h not in pending: pending[h] = t.encode('utf-8')[:4900].decode('utf-8', 'ignore')
+
+    fetched = {}
+    pending_hashes, pending_texts = list(pending), list(pending.values())
+    for i in range(0, len(pending_texts), COMPREHEND_BATCH_SIZE):
+        batch = pending_texts[i:i + COMPREHEND_BATCH_SIZE]
+        try:
+            resp = comprehend.batch_detect_sentiment(TextList=batch, LanguageCode='en')
+            for result in resp.get('ResultList', []):
+                fetched[pending_hashes[i + result['Index']]] = SENTIMENT_SCORES.get(result['Sentiment'], 0.0)
+            # Entries in resp.get('ErrorList', []) stay uncached and score neutral
+        except ClientError as e:
+            print(f"    - WARN: Comprehend batch failed ({e.response['Error']['Code']}), scoring {len(batch)} titles neutral")
+
+    for h, score in fetched.items():
+        _SENTIMENT_CACHE[h] = score
+        if len(_SENTIMENT_CACHE) > SENTIMENT_CACHE_MAX: _SENTIMENT_CACHE.popitem(last=False)
+    return np.fromiter(
+        (fetched[h] if h in fetched else _SENTIMENT_CACHE.get(h, 0.0) for h in hashes),
+        dtype=np.float32, count=len(hashes)
+    )
 
 # --- Helper: Read HISTORICAL PROCESSED News Metrics from DDB ---
-def read_historical_news_metrics(symbol, date_iso):
-    """Fetches PREVIOUSLY PROCESSED avg_sentiment_24h from DynamoDB for rolling calculation."""
+DDB_BATCH_GET_LIMIT = 100 # BatchGetItem per-request key limit
+DDB_BATCH_GET_MAX_RETRIES = 5
+HIST_CACHE_MAX = 10000
+_HIST_CACHE = OrderedDict() # {(symbol, date_iso): avg_sentiment_24h}, survives warm invocations
+
+def read_historical_news_metrics(symbol, date_isos):
+    """
+    Fetches PREVIOUSLY PROCESSED avg_sentiment_24h from DynamoDB for rolling calculation.
+    Uses BatchGetItem (eventually consistent) and returns {date_iso: avg_sentiment_24h}, 0.0 if missing.
+    Found values are cached per container; missing days are re-checked since they may be backfilled later.
+    """
+    metrics = {d: 0.0 for d in date_isos}
+    missing = []
+    for d in date_isos:
+        if (symbol, d) in _HIST_CACHE:
+            _HIST_CACHE.move_to_end((symbol, d))
+            metrics[d] = _HIST_CACHE[(symbol, d)]
+        else: missing.append(d)
+    keys = [{'ticker_date': f"{symbol}_{d}", 'datatype': 'news_metrics'} for d in missing]
     try:
-        pk = f"{symbol}_{date_iso}"
-        response = table.get_item(Key={'ticker_date': pk, 'datatype': 'news_metrics'})
-        if 'Item' in response:
-            item = response['Item']
-            # Only return the average needed for the rolling feature
-            return {'avg_sentiment_24h': float(item.get('avg_sentiment_24h', '0.0'))}
-        else: return {'avg_sentiment_24h': 0.0}
-    except Exception: return {'avg_sentiment_24h': 0.0}
+        for i in range(0, len(keys), DDB_BATCH_GET_LIMIT):
+            request = {DDB_TABLE: {
+                'Keys': keys[i:i + DDB_BATCH_GET_LIMIT],
+                'ConsistentRead': False,
+                'ProjectionExpression': 'ticker_date, avg_sentiment_24h'
+            }}
+            for attempt in range(DDB_BATCH_GET_MAX_RETRIES):
+                response = dynamodb.batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(DDB_TABLE, []):
+                    date_iso = item['ticker_date'][len(symbol) + 1:] # Symbols may contain '_'
+                    metrics[date_iso] = _HIST_CACHE[(symbol, date_iso)] = float(item.get('avg_sentiment_24h', '0.0'))
+                    if len(_HIST_CACHE) > HIST_CACHE_MAX: _HIST_CACHE.popitem(last=False)
+                request = response.get('UnprocessedKeys')
+                if not request: break
+                time.sleep(0.05 * (2 ** attempt)) # Exponential backoff on throttled keys
+    except Exception as e: print(f"    - WARN: Could not read historical news metrics for {symbol}: {e}")
+    return metrics
+
+# --- Helper: Read Raw News Columns ---
+NEWS_SCHEMA = pa.schema([('title', pa.string()), ('lang', pa.string())]) # Only columns used downstream
+
+def read_news_ndjson_gz(body):
+    """Parses gzipped NDJSON articles into columns {'title': [...], 'lang': [...]} without per-row dicts."""
+    raw = gzip.decompress(body)
+    if not raw.strip(): return {'title': [], 'lang': []}
+    parse_options = pajson.ParseOptions(explicit_schema=NEWS_SCHEMA, unexpected_field_behavior='ignore')
+    return pajson.read_json(pa.BufferReader(raw), parse_options=parse_options).to_pydict()
+
+def read_news_legacy_json(body, raw_news_key):
+    """Parses the legacy JSON layout (dict with 'articles' or a bare list) into the same columns."""
+    news_data = orjson.loads(body)
+    articles = []
+    # --- Check data type before accessing ---
+    if isinstance(news_data, dict) and "articles" in news_data:
+        articles = news_data.get("articles", [])
+    elif isinstance(news_data, list):
+        # If the whole file was just a list of articles
+        articles = news_data # Use the list directly
+    else:
+         print(f"    - WARN: Unexpected JSON format (not a dict with 'articles' or a list) in {raw_news_key}. Using defaults.")
+    articles = [article for article in articles if isinstance(article, dict)] # Added type check
+    return {'title': [a.get("title") for a in articles], 'lang': [a.get("lang") for a in articles]}
 
 # --- Function to Process CURRENT DAY Raw News ---
 def process_current_day_news(ticker, target_date_iso):
     """
-    Reads the raw news JSON from S3 for the target day, runs Comprehend,
-    and returns calculated metrics for THAT day. Handles unexpected list format.
+    Reads the raw news for the target day from S3 (NDJSON.gz, falling back to legacy JSON),
+    runs Comprehend, and returns calculated metrics for THAT day.
     """
-    raw_news_key = f"{NEWS_S3_PREFIX}{target_date_iso}/{ticker}.json"
+    raw_news_key = f"{NEWS_S3_PREFIX}{target_date_iso}/{ticker}.ndjson.gz"
     print(f"  - Reading raw news for target day: s3://{RAW_BUCKET}/{raw_news_key}")
     current_day_metrics = { # Defaults
         'avg_sentiment_24h': 0.0, 'news_count_24h': 0,
         'positive_count_24h': 0, 'negative_count_24h': 0,
         'sentiment_std_24h': 0.0
     }
-    articles = [] # Initialize articles as empty list
 
     try:
-        obj = s3_client.get_object(Bucket=RAW_BUCKET, Key=raw_news_key)
-        news_data = json.loads(obj['Body'].read().decode('utf-8'))
-
-        # --- Check data type before accessing ---
-        if isinstance(news_data, dict) and "articles" in news_data:
-            articles = news_data.get("articles", [])
-        elif isinstance(news_data, list):
-            # If the whole file was just a list of articles
-            print(f"    - WARN: Raw news file {raw_news_key} contained a list directly, not a dict. Processing list.")
-            articles = news_data # Use the list directly
-        else:
-             print(f"    - WARN: Unexpected JSON format (not a dict with 'articles' or a list) in {raw_news_key}. Using defaults.")
-
-        if articles: # Proceed only if articles list is not empty
-            sentiment_scores = []
-            pos_count, neg_count = 0, 0
-            for article in articles: # Ensure 'article' is expected dict format here
-                 if isinstance(article, dict) and article.get("lang") == "English": # Added type check
-                    title = article.get("title", "")
-                    if title and isinstance(title, str):
-                        score = get_sentiment_score(title)
-                        sentiment_scores.append(score)
-                        if score > 0: pos_count += 1
-                        elif score < 0: neg_count += 1
-
-            # Calculate metrics for THIS day
-            avg_sent = np.mean(sentiment_scores) if sentiment_scores else 0.0
-            sent_std = np.std(sentiment_scores) if len(sentiment_scores) >= 2 else 0.0
+        try:
+            obj = s3_client.get_object(Bucket=RAW_BUCKET, Key=raw_news_key)
+            news_cols = read_news_ndjson_gz(obj['Body'].read())
+        except ClientError as e:
+            if e.response['Error']['Code'] not in MISSING_OBJECT_CODES: raise
+            raw_news_key = f"{NEWS_S3_PREFIX}{target_date_iso}/{ticker}.json" # Files written before NDJSON.gz
+            obj = s3_client.get_object(Bucket=RAW_BUCKET, Key=raw_news_key)
+            news_cols = read_news_legacy_json(obj['Body'].read(), raw_news_key)
+
+        news_count = len(news_cols['title'])
+        if news_count: # Proceed only if there are articles
+            titles = [
+                title for title, lang in zip(news_cols['title'], news_cols['lang'])
+                if lang == "English" and title and isinstance(title, str)
+            ]
+            sentiment_scores = get_sentiment_scores(titles)
+
+            # Calculate metrics for THIS day (vectorized reductions over the score array)
+            avg_sent = float(sentiment_scores.mean()) if sentiment_scores.size else 0.0
+            sent_std = float(sentiment_scores.std()) if sentiment_scores.size >= 2 else 0.0
+            pos_count = int((sentiment_scores > 0).sum())
+            neg_count = int((sentiment_scores < 0).sum())
             current_day_metrics = {
                 'avg_sentiment_24h': avg_sent,
-                'news_count_24h': len(articles), # Count still reflects total articles found
+                'news_count_24h': news_count, # Count still reflects total articles found
                 'positive_count_24h': pos_count,
                 'negative_count_24h': neg_count,
                 'sentiment_std_24h': sent_std
             }
-            print(f"    - Calculated metrics for {target_date_iso}: Sent={avg_sent:.2f}, Count={len(articles)}")
-        # If articles list was empty from the start, defaults are kept
+            print(f"    - Calculated metrics for {target_date_iso}: Sent={avg_sent:.2f}, Count={news_count}")
+        # If there were no articles, defaults are kept
 
     except ClientError as e:
-        if e.response['Error']['Code'] == 'NoSuchKey':
-            print(f"    - Raw news file not found for {target_date_iso}. Using defaults.")
+        if e.response['Error']['Code'] in MISSING_OBJECT_CODES:
+            print(f"    - Raw news file not found for {target_date_iso} ({e.response['Error']['Code']}). Using defaults.")
         else:
             print(f"    - WARN: S3 Error reading raw news s3://{RAW_BUCKET}/{raw_news_key}: {e}")
-    except json.JSONDecodeError:
+    except (json.JSONDecodeError, pa.ArrowInvalid):
          print(f"    - WARN: Invalid JSON in {raw_news_key}. Using defaults.")
     except Exception as e:
         print(f"    - WARN: Error processing raw news for {target_date_iso}: {e}") # Catch other potential errors
@@ -121,6 +215,94 @@ def process_current_day_news(ticker, target_date_iso):
     return current_day_metrics
 
 
+# --- Helper: Fused Price/News Feature Kernel ---
+FEATURE_COLS = ( # Column order of the feature row handed to the model
+    'ret_1d', 'mom_5d', 'rsi_14', 'abn_volume', 'ret_lag_1d', 'volatility_20d',
+    'ma_50d', 'ma_200d', 'ma_trend_signal', 'day_of_week', 'month_of_year',
+    'return_x_volume', 'avg_sentiment_24h', 'news_count_24h',
+    'positive_count_24h', 'negative_count_24h', 'sentiment_std_24h',
+    'avg_sentiment_3d'
+)
+KERNEL_FEATURE_COLS = (
+    'ret_1d', 'mom_5d', 'rsi_14', 'abn_volume', 'ret_lag_1d', 'volatility_20d',
+    'ma_50d', 'ma_200d', 'ma_trend_signal', 'return_x_volume', 'avg_sentiment_3d'
+)
+_FEATURE_POS = {col: i for i, col in enumerate(FEATURE_COLS)}
+_KERNEL_COL_POS = np.array([_FEATURE_POS[col] for col in KERNEL_FEATURE_COLS])
+_OUT = np.empty((1, len(FEATURE_COLS)), dtype=np.float32) # Reused target-row buffer across warm invocations
+
+@njit(inline='always')
+def _slide(total, count, new, old):
+    """Adds new to / drops old from a running window sum, skipping NaNs. Returns (total, count)."""
+    if new == new: total += float(new); count += 1 # float(): float64 sums in the plain-Python fallback too
+    if old == old: total -= float(old); count -= 1
+    if count == 0: total = 0.0 # Empty window: snap accumulated rounding back to exactly 0
+    return total, count
+
+@njit(cache=True, error_model='numpy')
+def compute_features(close, volume, sent, out):
+    """
+    Single pass over the history, writing KERNEL_FEATURE_COLS (in order) into out[i, :].
+    Rolling windows use running add-new/subtract-old sums that count their non-NaN values,
+    as pandas' rolling(w, min_periods=1) and the kernels in processing/feature_builder.py do.
+    Inputs/out are float32; running sums accumulate in float64. Division follows numpy (x/0 -> inf/NaN).
+    """
+    n = close.shape[0]
+    gain_sum = 0.0; loss_sum = 0.0; nz_gain = 0; nz_loss = 0
+    vol_sum = 0.0; vol_count = 0; ma50_sum = 0.0; ma50_count = 0; ma200_sum = 0.0; ma200_count = 0
+    sent_sum = 0.0; sent_count = 0
+    ret_sum = 0.0; ret_sumsq = 0.0; ret_count = 0
+    ret_window = np.empty(20) # float64 returns as added to the sums (out[:, 0] holds them rounded to float32)
+    for i in range(n):
+        # Returns / momentum (pct_change, a NaN close gives NaN)
+        ret = float(close[i] / close[i - 1]) - 1.0 if i >= 1 else np.nan
+        out[i, 0] = ret
+        out[i, 1] = close[i] / close[i - 5] - 1.0 if i >= 5 else np.nan
+        out[i, 4] = out[i - 1, 0] if i >= 1 else np.nan
+
+        # RSI-14 over SMA of gains/losses (NaN deltas count as 0; an all-zero window snaps its sum to 0)
+        delta = float(close[i] - close[i - 1]) if i >= 1 else 0.0
+        old = float(close[i - 14] - close[i - 15]) if i >= 15 else 0.0
+        if delta > 0: gain_sum += delta; nz_gain += 1
+        elif delta < 0: loss_sum -= delta; nz_loss += 1
+        if old > 0: gain_sum -= old; nz_gain -= 1
+        elif old < 0: loss_sum += old; nz_loss -= 1
+        if nz_gain == 0: gain_sum = 0.0
+        if nz_loss == 0: loss_sum = 0.0
+        count = min(i + 1, 14)
+        avg_loss = loss_sum / count
+        if avg_loss <= 0: avg_loss = 1e-9
+        out[i, 2] = 100.0 - 100.0 / (1.0 + (gain_sum / count) / avg_loss)
+
+        # Abnormal volume vs 30d mean (an all-zero window gives NaN, filled with 0 below)
+        vol_sum, vol_count = _slide(vol_sum, vol_count, volume[i], volume[i - 30] if i >= 30 else np.nan)
+        out[i, 3] = volume[i] / (vol_sum / vol_count) if vol_count > 0 else np.nan
+
+        # 20d volatility of returns (sample std, NaN returns skipped); slides out the exact value it added
+        old = ret_window[i % 20] if i >= 20 else np.nan
+        ret_window[i % 20] = ret
+        if ret == ret: ret_sum += ret; ret_sumsq += ret * ret; ret_count += 1
+        if old == old: ret_sum -= old; ret_sumsq -= old * old; ret_count -= 1
+        if ret_count == 0: ret_sum = 0.0; ret_sumsq = 0.0
+        if ret_count >= 2:
+            var = (ret_sumsq - ret_sum * ret_sum / ret_count) / (ret_count - 1)
+            out[i, 5] = np.sqrt(var) if var > 0 else 0.0
+        else: out[i, 5] = np.nan
+
+        # Moving averages + trend signal (NaN compares False)
+        ma50_sum, ma50_count = _slide(ma50_sum, ma50_count, close[i], close[i - 50] if i >= 50 else np.nan)
+        ma200_sum, ma200_count = _slide(ma200_sum, ma200_count, close[i], close[i - 200] if i >= 200 else np.nan)
+        out[i, 6] = ma50_sum / ma50_count if ma50_count > 0 else np.nan
+        out[i, 7] = ma200_sum / ma200_count if ma200_count > 0 else np.nan
+        out[i, 8] = 1.0 if out[i, 6] > out[i, 7] else 0.0
+
+        out[i, 9] = ret * out[i, 3]
+
+        # Rolling news feature (3d mean of avg_sentiment_24h)
+        sent_sum, sent_count = _slide(sent_sum, sent_count, sent[i], sent[i - 3] if i >= 3 else np.nan)
+        out[i, 10] = sent_sum / sent_count if sent_count > 0 else np.nan
+
+
 # --- Main Feature Calculation Logic ---
 def calculate_single_day_features(ticker, target_date_iso, df_price_history):
     """
@@ -129,76 +311,63 @@ def calculate_single_day_features(ticker, target_date_iso, df_price_history):
     and fetching historical news metrics from DDB for rolling averages.
     """
     target_date = datetime.strptime(target_date_iso, "%Y-%m-%d").date()
+    target_ts = np.datetime64(target_date_iso, 'ns') # Compared directly against the datetime64 'date' column
     start_hist_news_lookback_date = target_date - timedelta(days=LOOKBACK_DAYS_NEWS_ROLLING)
 
     # --- 1. Process THIS Day's Raw News ---
     current_day_metrics = process_current_day_news(ticker, target_date_iso)
 
     # --- 2. Prepare Price Data ---
-    df = df_price_history.copy().sort_values("date")
+    # Stooq CSVs arrive in date order; only sort (which copies) when they don't.
+    # No defensive copy: the merge below returns a new frame and the caller does not reuse its input.
+    df = df_price_history if df_price_history['date'].is_monotonic_increasing else df_price_history.sort_values("date")
 
     # --- 3. Fetch HISTORICAL News Metrics (Avg Sentiment Only) for Rolling Calculation ---
-    historical_avg_sentiments = []
-    current_loop_date = start_hist_news_lookback_date
-    while current_loop_date < target_date: # Fetch history UP TO target date
-        date_iso_loop = current_loop_date.strftime("%Y-%m-%d")
-        hist_metrics = read_historical_news_metrics(ticker, date_iso_loop) # Reads DDB
-        hist_metrics['date_iso'] = date_iso_loop
-        historical_avg_sentiments.append(hist_metrics)
-        current_loop_date += timedelta(days=1)
-
-    df_hist_news = pd.DataFrame(historical_avg_sentiments)
+    hist_dates = [ # Fetch history UP TO target date
+        (start_hist_news_lookback_date + timedelta(days=n)).strftime("%Y-%m-%d")
+        for n in range((target_date - start_hist_news_lookback_date).days)
+    ]
+    historical_avg_sentiments = read_historical_news_metrics(ticker, hist_dates) # Reads DDB
+
+    df_hist_news = pd.DataFrame(
+        {'date_iso': list(historical_avg_sentiments), 'avg_sentiment_24h': list(historical_avg_sentiments.values())}
+    )
     if not df_hist_news.empty:
-        df_hist_news['date'] = pd.to_datetime(df_hist_news['date_iso'])
+        df_hist_news['date'] = df_hist_news['date_iso'].to_numpy(dtype='datetime64[ns]')
         df = pd.merge(df, df_hist_news[['date', 'avg_sentiment_24h']], on='date', how='left', suffixes=('', '_hist'))
 
     # Add CURRENT day's calculated sentiment BEFORE calculating rolling avg
-    target_date_dt = pd.to_datetime(target_date_iso)
-    df.loc[df['date'] == target_date_dt, 'avg_sentiment_24h'] = current_day_metrics['avg_sentiment_24h']
+    target_mask = df['date'].to_numpy() == target_ts
+    df.loc[target_mask, 'avg_sentiment_24h'] = current_day_metrics['avg_sentiment_24h']
     df['avg_sentiment_24h'] = df['avg_sentiment_24h'].fillna(0.0) # Fill missing history
 
     # --- 4. Calculate ALL Features (Price + Combined News) ---
-    # Price Features
-    df["ret_1d"] = df["close"].pct_change(1); df["mom_5d"] = df["close"].pct_change(5)
-    delta = df["close"].diff(); gain = np.where(delta > 0, delta, 0.0); loss = np.where(delta < 0, -delta, 0.0)
-    avg_gain = pd.Series(gain).rolling(14, min_periods=1).mean(); avg_loss = pd.Series(loss).rolling(14, min_periods=1).mean().replace(0, 1e-9)
-    rs = avg_gain / avg_loss; df["rsi_14"] = 100 - (100 / (1 + rs))
-    df["abn_volume"] = df["volume"] / df["volume"].rolling(30, min_periods=1).mean()
-    df['ret_lag_1d'] = df['ret_1d'].shift(1); df['volatility_20d'] = df['ret_1d'].rolling(20, min_periods=1).std()
-    df['ma_50d'] = df['close'].rolling(50, min_periods=1).mean(); df['ma_200d'] = df['close'].rolling(200, min_periods=1).mean()
-    df['ma_trend_signal'] = (df['ma_50d'] > df['ma_200d']).astype(int)
-    df['day_of_week'] = df['date'].dt.dayofweek; df['month_of_year'] = df['date'].dt.month
-    if 'abn_volume' in df.columns and df['abn_volume'].notna().any(): df['return_x_volume'] = df['ret_1d'] * df['abn_volume']
-    else: df['return_x_volume'] = 0.0
-    # Rolling News Feature (uses historical + current avg_sentiment_24h)
-    df['avg_sentiment_3d'] = df['avg_sentiment_24h'].rolling(3, min_periods=1).mean()
-
-    # --- 5. Select Target Row and Add Current Day's Specific News Metrics ---
-    latest_features_row = df[df['date'].dt.strftime('%Y-%m-%d') == target_date_iso].copy()
-    if latest_features_row.empty: return None
-
-    # Add the non-rolling news features calculated in step 1
-    latest_features_row['news_count_24h'] = current_day_metrics['news_count_24h']
-    latest_features_row['positive_count_24h'] = current_day_metrics['positive_count_24h']
-    latest_features_row['negative_count_24h'] = current_day_metrics['negative_count_24h']
-    latest_features_row['sentiment_std_24h'] = current_day_metrics['sentiment_std_24h']
-    latest_features_row['symbol'] = ticker
+    target_idx = target_mask.nonzero()[0]
+    if target_idx.size == 0: return None
+    out = np.empty((len(df), len(KERNEL_FEATURE_COLS)), dtype=np.float32)
+    compute_features(
+        df['close'].to_numpy(dtype=np.float32), df['volume'].to_numpy(dtype=np.float32),
+        df['avg_sentiment_24h'].to_numpy(dtype=np.float32), out
+    )
+
+    # --- 5. Fill the Target Row: kernel outputs + calendar + current day's news metrics ---
+    row = _OUT[0]
+    row[_KERNEL_COL_POS] = out[target_idx[0]]
+    row[_FEATURE_POS['day_of_week']] = target_date.weekday() # Monday=0, same as dt.dayofweek
+    row[_FEATURE_POS['month_of_year']] = target_date.month
+    for col in ('avg_sentiment_24h', 'news_count_24h', 'positive_count_24h', 'negative_count_24h', 'sentiment_std_24h'):
+        row[_FEATURE_POS[col]] = current_day_metrics[col]
 
     # --- 6. Final Checks & Return ---
-    expected_features_for_model = [
-        'ret_1d', 'mom_5d', 'rsi_14', 'abn_volume', 'ret_lag_1d', 'volatility_20d',
-        'ma_50d', 'ma_200d', 'ma_trend_signal', 'day_of_week', 'month_of_year',
-        'return_x_volume', 'avg_sentiment_24h', 'news_count_24h',
-        'positive_count_24h', 'negative_count_24h', 'sentiment_std_24h',
-        'avg_sentiment_3d'
-    ]
     # Check if any expected feature is NaN in the final row
-    if latest_features_row[expected_features_for_model].isnull().values.any():
+    nan_mask = np.isnan(row)
+    if nan_mask.any():
         print(f"  - WARN: Final feature row for {target_date_iso} contains NaNs after calculation. Filling with 0.")
-        print(latest_features_row[expected_features_for_model].isnull().sum())
-        latest_features_row = latest_features_row.fillna(0) # Simple imputation
+        print([col for col, is_nan in zip(FEATURE_COLS, nan_mask) if is_nan])
+        np.nan_to_num(row, copy=False) # Simple imputation
 
-    return latest_features_row
+    # Copy out of the shared buffer so the next invocation can't overwrite the returned frame
+    return pd.DataFrame(_OUT, columns=FEATURE_COLS, copy=True).assign(symbol=ticker, date=target_date_iso)
 
 
 # --- Lambda Handler ---
@@ -224,13 +393,15 @@ def lambda_handler(event, context):
 
             # 2. Read Triggering Price CSV (provides history)
             obj = s3_client.get_object(Bucket=bucket_name, Key=object_key)
-            df_price_full = pd.read_csv(io.BytesIO(obj["Body"].read()))
-            df_price_full.columns = df_price_full.columns.str.lower()
-            df_price_full['date'] = pd.to_datetime(df_price_full['date'])
+            price_table = pacsv.read_csv(
+                io.BytesIO(obj["Body"].read()),
+                convert_options=pacsv.ConvertOptions(column_types=PRICE_CSV_COLUMN_TYPES)
+            )
+            df_price_full = price_table.rename_columns([c.lower() for c in price_table.column_names]).to_pandas()
 
             # Filter necessary historical window
             min_hist_date = datetime.strptime(target_date_iso, "%Y-%m-%d").date() - timedelta(days=LOOKBACK_DAYS_PRICE)
-            df_price_hist = df_price_full[df_price_full['date'].dt.date >= min_hist_date].copy()
+            df_price_hist = df_price_full[df_price_full['date'].to_numpy() >= np.datetime64(min_hist_date, 'ns')]
 
             if df_price_hist.empty:
                 print(f"ERROR: No price data found in historical window for {object_key}")
@@ -244,11 +415,11 @@ def lambda_handler(event, context):
                 error_count += 1; continue
 
             # 4. Save Curated Features to S3
-            output_key = f"{FEATURE_S3_PREFIX.rstrip('/')}/{target_date_iso}/{ticker}_features.csv"
+            output_key = f"{FEATURE_S3_PREFIX.rstrip('/')}/{target_date_iso}/{ticker}_features.parquet"
             print(f"Saving features to: s3://{CURATED_BUCKET}/{output_key}")
-            csv_buffer = io.StringIO()
-            features_df.to_csv(csv_buffer, index=False)
-            s3_client.put_object(Bucket=CURATED_BUCKET, Key=output_key, Body=csv_buffer.getvalue())
+            parquet_buffer = io.BytesIO()
+            features_df.to_parquet(parquet_buffer, engine='pyarrow', compression='zstd', index=False)
+            s3_client.put_object(Bucket=CURATED_BUCKET, Key=output_key, Body=parquet_buffer.getvalue())
             success_count += 1
             print("  - Save successful.")
 
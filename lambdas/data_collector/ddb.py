@@ -1,7 +1,9 @@
 import boto3
 import os
+from botocore.config import Config
 
-_ddb = boto3.resource("dynamodb", region_name=os.getenv("AWS_DEFAULT_REGION", "us-east-1"))
+_config = Config(retries={'mode': 'adaptive', 'max_attempts': 3}, max_pool_connections=32, tcp_keepalive=True)
+_ddb = boto3.resource("dynamodb", region_name=os.getenv("AWS_DEFAULT_REGION", "us-east-1"), config=_config)
 
 def put_news_summary(table_name: str, item: dict):
     table = _ddb.Table(table_name)
@@ -1,13 +1,56 @@
-import requests
+import json
 import io
+import urllib3
+from urllib3.util.retry import Retry
+from s3io import upload_stream_to_s3
 
-# Fetch CSV price data from Stooq
-def fetch_prices_stooq_csv(ticker: str) -> bytes:
+# Shared pool so concurrent ticker fetches reuse TLS connections.
+# gzip is negotiated on the wire and decoded on read, so callers still get plain bytes.
+_http = urllib3.PoolManager(num_pools=4, maxsize=16, retries=Retry(total=3, backoff_factor=0.3))
+_HEADERS = {"Accept-Encoding": "gzip"}
+
+def _get(url: str):
+    response = _http.request("GET", url, headers=_HEADERS, preload_content=False)
+    try:
+        return response.status, response.read()
+    finally:
+        response.release_conn()
+
+_PEEK_SIZE = 64 * 1024
+
+class _PrefixedReader:
+    # File-like that replays bytes already read from a stream, then continues with the stream.
+    # read(n) returns exactly n bytes until EOF (s3transfer treats a short read as the end).
+    def __init__(self, head: bytes, stream):
+        self._head, self._stream = head, stream
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data, self._head = self._head + self._stream.read(), b""
+            return data
+        data, self._head = self._head[:size], self._head[size:]
+        if len(data) < size:
+            data += self._stream.read(size - len(data))
+        return data
+
+# Fetch CSV price data from Stooq and stream it straight to S3
+def fetch_and_upload_prices(ticker: str, bucket: str, key: str):
     url = f"https://stooq.com/q/d/l/?s={ticker.lower()}.us&i=d"
-    response = requests.get(url)
-    if response.status_code != 200 or not response.text.strip():
-        raise ValueError(f"Failed to fetch Stooq data for {ticker}")
-    return response.content
+    response = _http.request("GET", url, headers=_HEADERS, preload_content=False)
+    try:
+        if response.status != 200:
+            raise ValueError(f"Failed to fetch Stooq data for {ticker}")
+        # Peek at the decoded body: empty/whitespace-only responses (chunked or gzip ones carry
+        # no Content-Length) are rejected before anything is uploaded
+        head = b""
+        while not head.strip():
+            chunk = response.read(_PEEK_SIZE)
+            if not chunk:
+                raise ValueError(f"Failed to fetch Stooq data for {ticker}")
+            head += chunk
+        upload_stream_to_s3(bucket, key, _PrefixedReader(head, response))
+    finally:
+        response.release_conn()
 
 # Fetch latest news from GDELT API
 def fetch_gdelt_articles(keyword: str, max_records: int = 25):
@@ -15,10 +58,10 @@ def fetch_gdelt_articles(keyword: str, max_records: int = 25):
         "https://api.gdeltproject.org/api/v2/doc/doc?query="
         f"{keyword}&mode=ArtList&format=json"
     )
-    response = requests.get(url)
-    if response.status_code != 200:
+    status, body = _get(url)
+    if status != 200:
         raise ValueError(f"GDELT API error for {keyword}")
-    data = response.json()
+    data = json.loads(body)
     articles = data.get("articles", [])[:max_records]
     cleaned = [
         {
@@ -1,10 +1,40 @@
 import os
 import json
+import gzip
 import datetime
-from fetchers import fetch_prices_stooq_csv, fetch_gdelt_articles
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fetchers import fetch_and_upload_prices, fetch_gdelt_articles
 from s3io import upload_filelike_to_s3
 from ddb import put_news_summary
 
+def process_ticker(ticker, today, bucket, table, max_records, price_path, news_path):
+    # 1️⃣ Fetch price CSV from Stooq (streamed to S3)
+    s3_price_key = f"{price_path}{today}/{ticker}.csv"
+    fetch_and_upload_prices(ticker, bucket, s3_price_key)
+
+    # 2️⃣ Fetch news articles from GDELT
+    news_articles = fetch_gdelt_articles(ticker, max_records)
+    s3_news_key = f"{news_path}{today}/{ticker}.ndjson.gz"
+    ndjson = "".join(json.dumps(article) + "\n" for article in news_articles)
+    upload_filelike_to_s3(bucket, s3_news_key, gzip.compress(ndjson.encode()))
+
+    # 3️⃣ Save news summary to DynamoDB
+    item = {
+        "ticker_date": f"{ticker}_{today}",
+        "datatype": "news",
+        "source": "GDELT",
+        "count_24h": len(news_articles),
+        "articles": news_articles,
+        "ingested_at": datetime.datetime.utcnow().isoformat() + "Z",
+    }
+    put_news_summary(table, item)
+
+    return {
+        "ticker": ticker,
+        "price_key": s3_price_key,
+        "news_count": len(news_articles)
+    }
+
 def lambda_handler(event, context):
     # --- Configuration ---
     today = datetime.date.today().strftime("%Y-%m-%d")
@@ -17,38 +47,17 @@ def lambda_handler(event, context):
 
     results, errors = [], []
 
-    # --- For each stock ticker ---
-    for ticker in watchlist:
-        try:
-            # 1️⃣ Fetch price CSV from Stooq
-            csv_bytes = fetch_prices_stooq_csv(ticker)
-            s3_price_key = f"{price_path}{today}/{ticker}.csv"
-            upload_filelike_to_s3(bucket, s3_price_key, csv_bytes)
-
-            # 2️⃣ Fetch news articles from GDELT
-            news_articles = fetch_gdelt_articles(ticker, max_records)
-            s3_news_key = f"{news_path}{today}/{ticker}.json"
-            upload_filelike_to_s3(bucket, s3_news_key, json.dumps(news_articles).encode())
-
-            # 3️⃣ Save news summary to DynamoDB
-            item = {
-                "ticker_date": f"{ticker}_{today}",
-                "datatype": "news",
-                "source": "GDELT",
-                "count_24h": len(news_articles),
-                "articles": news_articles,
-                "ingested_at": datetime.datetime.utcnow().isoformat() + "Z",
-            }
-            put_news_summary(table, item)
-
-            results.append({
-                "ticker": ticker,
-                "price_key": s3_price_key,
-                "news_count": len(news_articles)
-            })
-
-        except Exception as e:
-            errors.append({"ticker": ticker, "error": str(e)})
+    # --- For each stock ticker (I/O-bound, so overlap the network legs) ---
+    with ThreadPoolExecutor(max_workers=max(1, len(watchlist))) as pool:
+        futures = {
+            pool.submit(process_ticker, ticker, today, bucket, table, max_records, price_path, news_path): ticker
+            for ticker in watchlist
+        }
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                errors.append({"ticker": futures[future], "error": str(e)})
 
     return {
         "statusCode": 200,
@@ -1,8 +1,18 @@
 import boto3
 import os
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
 
-_s3 = boto3.client("s3", region_name=os.getenv("AWS_DEFAULT_REGION", "us-east-1"))
+_config = Config(retries={'mode': 'adaptive', 'max_attempts': 3}, max_pool_connections=32, tcp_keepalive=True)
+_s3 = boto3.client("s3", region_name=os.getenv("AWS_DEFAULT_REGION", "us-east-1"), config=_config)
 
 def upload_filelike_to_s3(bucket: str, key: str, file_bytes: bytes):
     _s3.put_object(Bucket=bucket, Key=key, Body=file_bytes)
     print(f"✅ Uploaded to s3://{bucket}/{key}")
+
+_transfer_config = TransferConfig(multipart_threshold=8 * 1024 * 1024)
+
+def upload_stream_to_s3(bucket: str, key: str, fileobj):
+    # Streams a file-like (e.g. an HTTP response) to S3 without buffering the whole body
+    _s3.upload_fileobj(fileobj, bucket, key, Config=_transfer_config)
+    print(f"✅ Streamed to s3://{bucket}/{key}")
@@ -1,9 +1,11 @@
 import os
 import json
-import math
+import hashlib
+import orjson
 from decimal import Decimal
 import boto3
 import botocore
+from botocore.config import Config
 from datetime import datetime
 from typing import Dict, Any, List
 from boto3.dynamodb.types import TypeDeserializer
@@ -20,9 +22,11 @@ MAX_TOKENS = int(os.getenv("MAX_TOKENS", "250"))
 TEMPERATURE = float(os.getenv("TEMPERATURE", "0.2"))
 ALLOW_FALLBACK = os.getenv("ALLOW_FALLBACK", "true").lower() == "true"
 
-dynamodb = boto3.resource("dynamodb", region_name=REGION)
+# Shared client config: pooled keep-alive connections, adaptive retries
+BOTO_CONFIG = Config(retries={'mode': 'adaptive', 'max_attempts': 3}, max_pool_connections=32, tcp_keepalive=True)
+dynamodb = boto3.resource("dynamodb", region_name=REGION, config=BOTO_CONFIG)
 table = dynamodb.Table(TABLE_NAME)
-bedrock  = boto3.client("bedrock-runtime", region_name=REGION)
+bedrock  = boto3.client("bedrock-runtime", region_name=REGION, config=BOTO_CONFIG)
 
 # --- DynamoDB Stream Utilities ---
 ddb_deserializer = TypeDeserializer()
@@ -36,7 +40,7 @@ SYSTEM_PROMPT = (
 
 # --- JSON converter for Decimal objects ---
 def _json_decimal_converter(o):
-    """Converts Decimal objects to float for json.dumps."""
+    """Converts Decimal objects to float for orjson.dumps."""
     if isinstance(o, Decimal):
         return float(o)
     raise TypeError(f"Object of type {o.__class__.__name__} is not JSON serializable")
@@ -50,9 +54,9 @@ def _build_prompt(ticker: str, date_str: str, shap_dict: Dict[str, Any], metrics
         f"Ticker: {ticker}\nDate: {date_str}\n\n"
         f"Signals (SHAP-style, value = contribution score):\n"
         # Use the custom converter to handle Decimals from DDB
-        f"{json.dumps(shap_dict, ensure_ascii=False, indent=2, default=_json_decimal_converter)}\n\n"
+        f"{orjson.dumps(shap_dict, option=orjson.OPT_INDENT_2, default=_json_decimal_converter).decode()}\n\n"
         f"Metrics (e.g., probability, predicted direction):\n"
-        f"{json.dumps(metrics, ensure_ascii=False, indent=2, default=_json_decimal_converter)}\n\n"
+        f"{orjson.dumps(metrics, option=orjson.OPT_INDENT_2, default=_json_decimal_converter).decode()}\n\n"
         "Task: In 2-3 sentences, explain why the model predicts UP or DOWN. "
         "Name the most influential positive and negative factors. Keep it concise."
     )
@@ -61,21 +65,15 @@ def _build_prompt(ticker: str, date_str: str, shap_dict: Dict[str, Any], metrics
 
 def _to_dynamo(value):
     """
-    Recursively convert floats to Decimal for DynamoDB.
-    Also string-ify NaN/Inf to avoid DynamoDB rejection.
+    Convert floats to Decimal for DynamoDB via one C-level JSON round-trip
+    (no Python recursion). NaN/Inf and unknown types are string-ified to
+    avoid DynamoDB rejection.
     """
-    if isinstance(value, float):
-        if math.isnan(value) or math.isinf(value):
-            return str(value)  # store as string if not a finite number
-        return Decimal(str(value))
-    if isinstance(value, (int, bool, str)) or value is None:
-        return value
-    if isinstance(value, dict):
-        return {k: _to_dynamo(v) for k, v in value.items()}
-    if isinstance(value, (list, tuple)):
-        return [_to_dynamo(v) for v in value]
-    # Fallback: stringify unknown types
-    return str(value)
+    return json.loads(
+        json.dumps(value, default=str),
+        parse_float=Decimal,
+        parse_constant=lambda c: str(float(c)),  # NaN/Infinity -> 'nan'/'inf'
+    )
 
 # ---------- Bedrock invokers (Unchanged) ----------
 
@@ -99,11 +97,11 @@ def _invoke_anthropic_claude(prompt: str, model_id: str) -> Dict[str, Any]:
     }
     resp = bedrock.invoke_model(
         modelId=model_id,
-        body=json.dumps(body).encode("utf-8"),
+        body=orjson.dumps(body),
         accept="application/json",
         contentType="application/json",
     )
-    payload = json.loads(resp["body"].read())
+    payload = orjson.loads(resp["body"].read())
     text = "".join(part.get("text", "") for part in payload.get("content", []))
     return {"text": text, "raw": payload}
 
@@ -115,11 +113,11 @@ def _invoke_amazon_titan(prompt: str, model_id: str) -> Dict[str, Any]:
     }
     resp = bedrock.invoke_model(
         modelId=model_id,
-        body=json.dumps(body).encode("utf-8"),
+        body=orjson.dumps(body),
         accept="application/json",
         contentType="application/json",
     )
-    payload = json.loads(resp["body"].read())
+    payload = orjson.loads(resp["body"].read())
     text = (payload.get("results") or [{}])[0].get("outputText", "")
     return {"text": text, "raw": payload}
 
@@ -160,7 +158,7 @@ def _safe_invoke(prompt: str) -> Dict[str, Any]:
 
 # ---------- Storage ----------
 
-def _put_explanation_item(
+def _build_explanation_item(
     ticker: str,
     date_str: str,
     explanation: str,
@@ -168,6 +166,7 @@ def _put_explanation_item(
     metrics: Dict[str, Any],
     model_id: str,
     raw: Dict[str, Any],
+    signature: str,
 ) -> Dict[str, Any]:
     key = f"{ticker}_{date_str}"
     item = {
@@ -181,12 +180,61 @@ def _put_explanation_item(
         "created_at": datetime.utcnow().isoformat() + "Z",
         "trace": {
             "provider": "bedrock",
-            "token_note": f"max_tokens={MAX_TOKENS}, temp={TEMPERATURE}"
+            "token_note": f"max_tokens={MAX_TOKENS}, temp={TEMPERATURE}",
+            "signature": signature,
         },
     }
-    table.put_item(Item=item)
     return item
 
+def _write_explanation_items(items: List[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Writes the batch's explanation items with one batch writer (25 items per BatchWriteItem).
+    If the batched write fails (e.g. at flush), falls back to one put_item per item so each
+    item's outcome is known. Returns {ticker_date: error} for the items that were not written.
+    """
+    if not items:
+        return {}
+    try:
+        # Duplicate keys within a batch keep the last write
+        with table.batch_writer(overwrite_by_pkeys=["ticker_date", "datatype"]) as writer:
+            for item in items:
+                writer.put_item(Item=item)
+        return {}
+    except Exception as e:
+        print(f"[WARN] Batched explanation write failed ({e}); retrying {len(items)} items one by one.")
+    failed = {}
+    for item in items:
+        try:
+            table.put_item(Item=item)
+        except Exception as e:
+            print(f"[ERROR] Failed to save explanation for {item['ticker_date']}: {e}")
+            failed[item["ticker_date"]] = str(e)
+    return failed
+
+# ---------- Explanation de-duplication ----------
+
+def _explanation_signature(ticker_date_key: str, shap_dict: Dict[str, Any], metrics: Dict[str, Any]) -> str:
+    """
+    Stable hash of everything the prompt depends on. Namespaced by MODEL_ID so
+    switching models regenerates explanations.
+    """
+    payload = {"model_id": MODEL_ID, "ticker_date": ticker_date_key, "shap": shap_dict, "metrics": metrics}
+    blob = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS, default=_json_decimal_converter)
+    return hashlib.blake2b(blob, digest_size=16).hexdigest()
+
+def _get_existing_signature(ticker_date_key: str) -> str:
+    """Returns the signature stored on the current 'explanation' item, or '' if none."""
+    try:
+        resp = table.get_item(
+            Key={"ticker_date": ticker_date_key, "datatype": "explanation"},
+            ProjectionExpression="#tr.#sig",
+            ExpressionAttributeNames={"#tr": "trace", "#sig": "signature"},
+        )
+        return resp.get("Item", {}).get("trace", {}).get("signature", "")
+    except Exception as e:
+        print(f"[WARN] Could not read existing explanation signature for {ticker_date_key}: {e}")
+        return ""
+
 # ---------- DynamoDB Stream Helpers ----------
 
 def _deserialize_ddb_item(ddb_item: Dict[str, Any]) -> Dict[str, Any]:
@@ -246,7 +294,10 @@ def lambda_handler(event, context):
     """
     print(f"[INFO] Received {len(event.get('Records', []))} records from DDB stream.")
     processed: List[Dict[str, Any]] = []
+    skipped_count = 0
 
+    # Explanations are built per record and written together once Bedrock is done
+    items: List[Dict[str, Any]] = []
     for record in event.get("Records", []):
         # 1. Check if it's a new 'shap' item
         if record.get("eventName") not in ("INSERT", "MODIFY"):
@@ -290,6 +341,13 @@ def lambda_handler(event, context):
         if not metrics:
             print(f"[WARN] Proceeding without metrics for {ticker_date_key}")
 
+        # 3.1 Skip the (paid) Bedrock call if these exact inputs were already explained
+        signature = _explanation_signature(ticker_date_key, shap_dict, metrics)
+        if _get_existing_signature(ticker_date_key) == signature:
+            print(f"[INFO] Explanation for {ticker_date_key} is up to date. Skipping Bedrock.")
+            skipped_count += 1
+            continue
+
         # 4. Build prompt and invoke Bedrock
         prompt = _build_prompt(ticker, date_str, shap_dict, metrics)
 
@@ -299,14 +357,12 @@ def lambda_handler(event, context):
             model_used  = bedrock_out.get("model_used", MODEL_ID)
         except Exception as e:
             print(f"[ERROR] Bedrock invocation failed for {ticker_date_key}: {e}")
-            explanation = (
-                "Explanation currently unavailable. Key drivers were: "
-                + ", ".join(f"{k} ({v:+.2f})" for k, v in shap_dict.items())
-                + "."
-            )
+            explanation = "" # Fallback text is filled in below
             model_used = f"{MODEL_ID} (errored)"
             bedrock_out = {"raw": {"error": str(e)}}
 
+        # Only a real Bedrock answer records the signature; fallback text must be retried next time
+        stored_signature = signature if explanation else ""
         if not explanation:
             explanation = (
                 "Explanation currently unavailable. Key drivers were: "
@@ -314,23 +370,28 @@ def lambda_handler(event, context):
                 + "."
             )
 
-        # 5. Save the new explanation item
-        try:
-            _put_explanation_item(
-                ticker, date_str, explanation, shap_dict, metrics, model_used, bedrock_out.get("raw", {})
-            )
-            print(f"[INFO] Successfully saved explanation for {ticker_date_key}")
-            processed.append({
-                "ticker_date": ticker_date_key,
-                "status": "ok",
-                "model_used": model_used,
-                "explanation": explanation
-            })
-        except Exception as e:
-            print(f"[ERROR] Failed to save explanation for {ticker_date_key}: {e}")
+        # 5. Build the explanation item (written after the loop)
+        items.append(_build_explanation_item(
+            ticker, date_str, explanation, shap_dict, metrics, model_used, bedrock_out.get("raw", {}), stored_signature
+        ))
+        processed.append({
+            "ticker_date": ticker_date_key,
+            "model_used": model_used,
+            "explanation": explanation
+        })
+
+    # 6. Save the explanation items; report each record's actual outcome
+    failed = _write_explanation_items(items)
+    for entry in processed:
+        error = failed.get(entry["ticker_date"])
+        entry["status"] = "error" if error else "ok"
+        if error: entry["error"] = error
+    print(f"[INFO] Saved {len(items) - len(failed)} explanations ({len(failed)} failed).")
 
     return {
-        "status": "ok",
-        "processed_count": len(processed),
+        "status": "partial" if failed else "ok",
+        "processed_count": len(processed) - len(failed),
+        "failed_count": len(failed),
+        "skipped_count": skipped_count,
         "processed_items": processed
     }
\ No newline at end of file
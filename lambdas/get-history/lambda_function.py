@@ -1,100 +1,115 @@
 import os
 import json
+import orjson
+import base64
+import binascii
 import boto3
 from decimal import Decimal
-from boto3.dynamodb.conditions import Attr # We need Attr for filtering
+from botocore.config import Config
+from boto3.dynamodb.conditions import Key
 
 # --- Environment Variables (Set in Lambda Configuration) ---
 # DDB_TABLE: Your DynamoDB table name (e.g., StockCopilotTable)
 DDB_TABLE = os.environ['DDB_TABLE'] 
 REGION = os.environ.get('AWS_REGION', 'us-east-1')
+# GSI: PK 'ticker', SK 'datatype_sk' ("<datatype>#<ingested_at>"), written by inference-caller
+HISTORY_INDEX = os.environ.get('HISTORY_INDEX', 'TickerDatatypeIndex')
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Fields the frontend reads (HistoryApiResponse); internal ones like features_blob/datatype_sk/shap_inline stay server-side
+HISTORY_FIELDS = [
+    'ticker_date', 'datatype', 'prediction', 'confidence', 'probability_up',
+    'model_version', 'features_s3_path', 'data_found_for', 'ingested_at'
+]
 
-# --- AWS Clients ---
-dynamodb = boto3.resource("dynamodb", region_name=REGION)
+# --- AWS Clients (keep-alive connections reused across warm invocations, fail-fast timeouts) ---
+BOTO_CONFIG = Config(retries={'mode': 'adaptive', 'max_attempts': 3}, max_pool_connections=10, tcp_keepalive=True, connect_timeout=1, read_timeout=3)
+dynamodb = boto3.resource("dynamodb", region_name=REGION, config=BOTO_CONFIG)
 table = dynamodb.Table(DDB_TABLE)
 
-# --- Helper to convert DynamoDB's Decimal to JSON-safe float/int ---
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, Decimal):
-            if o % 1 == 0:
-                return int(o)
-            else:
-                return float(o)
-        return super(DecimalEncoder, self).default(o)
+# --- Helper to convert DynamoDB's Decimal to JSON-safe float/int (orjson default hook) ---
+def _decimal_default(o):
+    if isinstance(o, Decimal):
+        return int(o) if o % 1 == 0 else float(o)
+    raise TypeError(f"Object of type {o.__class__.__name__} is not JSON serializable")
 
 # --- Lambda Handler ---
 def lambda_handler(event, context):
     """
     Handles API Gateway requests to get all PREDICTION history for a ticker
-    using an inefficient, but functional, DynamoDB SCAN.
+    using a DynamoDB QUERY on the TickerDatatypeIndex GSI.
     
-    1. Parses ticker from the path.
-    2. Scans the *entire* table.
-    3. Filters for items where 'ticker_date' starts with the ticker 
-       AND 'datatype' is 'prediction'.
-    4. Returns the items as a JSON array.
+    1. Parses ticker from the path, plus optional ?limit=N&next=<token>.
+    2. Queries the GSI for ticker = TICKER and datatype_sk beginning with
+       'prediction#' (newest first). Without limit/next the whole history
+       is returned (what the frontend expects); with either, ONE page.
+    3. Returns the items as a JSON array; for a page with more items after
+       it, the 'X-Next-Token' header holds the token for the following page.
+    
+    Note: only items carrying the 'ticker'/'datatype_sk' attributes are
+    indexed: run script/backfill_history_index.py --create-index before
+    deploying, so predictions written before inference-caller set them stay visible.
     """
     print("Received API Gateway event:", json.dumps(event))
 
-    # --- 1. Parse Ticker from Path ---
+    # --- 1. Parse Ticker from Path (+ page size / continuation token) ---
     try:
         ticker = event['pathParameters']['ticker'].upper()
-        print(f"Request Parsed - Ticker: {ticker}")
+        query_params = event.get('queryStringParameters') or {}
+        paged = 'limit' in query_params or 'next' in query_params # Opt-in paging; plain requests get everything
+        limit = min(max(int(query_params.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        next_token = query_params.get('next')
+        start_key = json.loads(base64.urlsafe_b64decode(next_token)) if next_token else None
+        print(f"Request Parsed - Ticker: {ticker}, Paged: {paged}, Limit: {limit}, Continuing: {bool(start_key)}")
         
-    except (KeyError, TypeError) as e:
+    except (KeyError, TypeError, ValueError, binascii.Error) as e:
         print(f"ERROR: Invalid input format: {e}")
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({"error": "Invalid input. Provide ticker in path (e.g., /get-history/AAPL)."})
+            'body': json.dumps({"error": "Invalid input. Provide ticker in path (e.g., /get-history/AAPL). Optional limit (1-1000) and next token query params."})
         }
 
-    # --- 2. Scan the Table (Warning: Inefficient) ---
+    # --- 2. Query the GSI (reads only this ticker's prediction items) ---
     try:
-        # --- THIS IS THE MODIFIED PART ---
-        
-        # Filter 1: 'ticker_date' (PK) string must begin with "TICKER_"
-        filter_ticker = Attr('ticker_date').begins_with(f"{ticker}_")
-        
-        # Filter 2: 'datatype' string must be exactly "prediction"
-        filter_datatype = Attr('datatype').eq('prediction')
-        
-        # Combine the filters: Both must be true
-        combined_filter = filter_ticker & filter_datatype
-
-        # --- END OF MODIFICATION ---
-
-        scan_args = {
-            'FilterExpression': combined_filter
+        query_args = {
+            'IndexName': HISTORY_INDEX,
+            'KeyConditionExpression': Key('ticker').eq(ticker) & Key('datatype_sk').begins_with('prediction#'),
+            'ScanIndexForward': False, # Newest first
+            'ProjectionExpression': ', '.join(f"#f{i}" for i in range(len(HISTORY_FIELDS))),
+            'ExpressionAttributeNames': {f"#f{i}": name for i, name in enumerate(HISTORY_FIELDS)}
         }
-        
-        items = []
-        
-        # Handle pagination (Scan can only return 1MB at a time)
-        while True:
-            response = table.scan(**scan_args)
+        if paged:
+            query_args['Limit'] = limit
+        if start_key:
+            query_args['ExclusiveStartKey'] = start_key
+
+        # Paged: one page, the client asks for the next one with ?next=<X-Next-Token>.
+        # Otherwise follow LastEvaluatedKey until the ticker's history is complete.
+        response = table.query(**query_args)
+        items = response.get('Items', [])
+        while not paged and 'LastEvaluatedKey' in response:
+            response = table.query(**query_args, ExclusiveStartKey=response['LastEvaluatedKey'])
             items.extend(response.get('Items', []))
-            
-            if 'LastEvaluatedKey' not in response:
-                break # Exit the loop if all items have been fetched
-            
-            scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
 
-        print(f"Scan complete: Found {len(items)} PREDICTION items for {ticker}")
+        print(f"Query complete: Found {len(items)} PREDICTION items for {ticker}")
 
         # --- 3. Return API Response ---
+        headers = {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'X-Next-Token'
+        }
+        if 'LastEvaluatedKey' in response:
+            headers['X-Next-Token'] = base64.urlsafe_b64encode(orjson.dumps(response['LastEvaluatedKey'], default=_decimal_default)).decode()
         return {
             'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps(items, cls=DecimalEncoder)
+            'headers': headers,
+            'body': orjson.dumps(items, default=_decimal_default).decode()
         }
 
     except Exception as e:
-        print(f"ERROR: DynamoDB scan failed: {e}")
+        print(f"ERROR: DynamoDB query failed: {e}")
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -1,12 +1,15 @@
 import os
 import io
 import json
+import orjson
+import zlib
+import time
+import base64
 import boto3
 import pandas as pd
 from datetime import datetime, timedelta, date
+from botocore.config import Config
 from botocore.exceptions import ClientError
-# --- New Import ---
-import time 
 
 # --- Environment Variables ---
 CURATED_BUCKET = os.environ['CURATED_BUCKET']
@@ -15,13 +18,63 @@ REGION = "us-east-1"
 FEATURE_S3_PREFIX = os.environ.get('FEATURE_S3_PREFIX', "features/daily_inference/") 
 SAGEMAKER_ENDPOINT_NAME = os.environ['SAGEMAKER_ENDPOINT_NAME'] # Name of deployed endpoint
 MODEL_VERSION_TAG = os.environ.get('MODEL_VERSION_TAG', 'best-tuned') # Identifier for the deployed model
+SHAP_FUNCTION_NAME = os.environ.get('SHAP_FUNCTION_NAME') # shap_explainer Lambda, invoked synchronously (unset = stream only)
+MISSING_OBJECT_CODES = ('NoSuchKey', 'AccessDenied') # Without s3:ListBucket a missing key is AccessDenied
+API_TIME_BUDGET_SECONDS = 25 # API Gateway cuts the request at 29s
+EXPLANATION_WAIT_SECONDS = float(os.environ.get('EXPLANATION_WAIT_SECONDS', '8')) # Max wait for the stream-driven Bedrock explanation
+EXPLANATION_POLL_INTERVAL = 0.5
 
-# --- AWS Clients ---
-s3_client = boto3.client("s3")
-dynamodb = boto3.resource("dynamodb", region_name=REGION)
+# --- AWS Clients (shared config: pooled keep-alive connections, adaptive retries, fail-fast timeouts) ---
+BOTO_CONFIG = Config(retries={'mode': 'adaptive', 'max_attempts': 3}, max_pool_connections=32, tcp_keepalive=True, connect_timeout=1, read_timeout=3)
+# Model inference / synchronous SHAP can exceed 3s. Single attempt: both together stay inside the API budget,
+# and a timed-out SHAP invoke is not re-run (it would write its shap item twice)
+LONG_CALL_CONFIG = BOTO_CONFIG.merge(Config(read_timeout=10, retries={'mode': 'adaptive', 'total_max_attempts': 1}))
+s3_client = boto3.client("s3", config=BOTO_CONFIG)
+dynamodb = boto3.resource("dynamodb", region_name=REGION, config=BOTO_CONFIG)
 table = dynamodb.Table(DDB_TABLE)
 # Use boto3 sagemaker-runtime client to invoke endpoint
-sagemaker_runtime = boto3.client('sagemaker-runtime', region_name=REGION)
+sagemaker_runtime = boto3.client('sagemaker-runtime', region_name=REGION, config=LONG_CALL_CONFIG)
+lambda_client = boto3.client('lambda', region_name=REGION, config=LONG_CALL_CONFIG)
+
+# --- Helper: SHAP via synchronous shap_explainer invoke (no DDB wait loop) ---
+def invoke_shap(ticker, target_date_iso, features_blob):
+    """Returns {"top_features": [...], "values": [...]} or {} if the call fails."""
+    try:
+        resp = lambda_client.invoke(
+            FunctionName=SHAP_FUNCTION_NAME,
+            InvocationType='RequestResponse',
+            Payload=json.dumps({'ticker': ticker, 'asof': target_date_iso, 'data_found_for': target_date_iso, 'features_blob': features_blob})
+        )
+        result = json.loads(resp['Payload'].read())
+        if resp.get('FunctionError') or result.get('statusCode') != 200:
+            print(f"ERROR from SHAP function: {result}")
+            return {}
+        top_factors = json.loads(result['body'])['top_factors']
+        return {"top_features": [f for f, _ in top_factors], "values": [str(v) for _, v in top_factors]}
+    except Exception as e:
+        print(f"ERROR invoking SHAP function {SHAP_FUNCTION_NAME}: {e}")
+        return {}
+
+# --- Helper: Read Daily Features (Parquet, falling back to legacy CSV) ---
+def read_features_from_s3(ticker, target_date_iso):
+    """Returns (df_features, s3_key). Raises the S3 ClientError (key attached as .s3_key) if neither file is readable."""
+    feature_s3_key = f"{FEATURE_S3_PREFIX.rstrip('/')}/{target_date_iso}/{ticker}_features.parquet"
+    print(f"Attempting to read features from: s3://{CURATED_BUCKET}/{feature_s3_key}")
+    try:
+        obj = s3_client.get_object(Bucket=CURATED_BUCKET, Key=feature_s3_key)
+        return pd.read_parquet(io.BytesIO(obj['Body'].read())), feature_s3_key
+    except ClientError as e:
+        if e.response['Error']['Code'] not in MISSING_OBJECT_CODES:
+            e.s3_key = feature_s3_key
+            raise
+    feature_s3_key = f"{FEATURE_S3_PREFIX.rstrip('/')}/{target_date_iso}/{ticker}_features.csv" # Written before the Parquet switch
+    print(f"Parquet features not found, trying: s3://{CURATED_BUCKET}/{feature_s3_key}")
+    try:
+        obj = s3_client.get_object(Bucket=CURATED_BUCKET, Key=feature_s3_key)
+    except ClientError as e:
+        e.s3_key = feature_s3_key
+        raise
+    return pd.read_csv(obj['Body']), feature_s3_key # Parse straight from the StreamingBody
 
 # --- Lambda Handler ---
 def lambda_handler(event, context):
@@ -31,11 +84,12 @@ def lambda_handler(event, context):
     2. Reads pre-calculated daily features from S3.
     3. Invokes SageMaker endpoint.
     4. Parses prediction response.
-    5. Saves prediction to DynamoDB (triggers SHAP/Explanation).
-    6. WAITS, then QUERIES DDB for SHAP/Explanation data.
+    5. Saves prediction to DynamoDB, then computes SHAP synchronously (shap_explainer; its shap item triggers Explanation).
+    6. Waits (bounded) for the Explanation; falls back to a stored SHAP item if the synchronous call failed.
     7. Returns prediction + explanation via API Gateway.
     """
     print("Received API Gateway event:", json.dumps(event))
+    started = time.monotonic()
 
     # --- 1. Parse Input from API Gateway ---
     try:
@@ -59,30 +113,29 @@ def lambda_handler(event, context):
         }
 
     # --- 2. Read Pre-Calculated Daily Features from S3 ---
-    feature_s3_key = f"{FEATURE_S3_PREFIX.rstrip('/')}/{target_date_iso}/{ticker}_features.csv"
-    print(f"Attempting to read features from: s3://{CURATED_BUCKET}/{feature_s3_key}")
+    feature_s3_key = f"{FEATURE_S3_PREFIX.rstrip('/')}/{target_date_iso}/{ticker}_features.parquet"
     try:
-        obj = s3_client.get_object(Bucket=CURATED_BUCKET, Key=feature_s3_key)
-        df_features = pd.read_csv(io.BytesIO(obj['Body'].read()))
+        df_features, feature_s3_key = read_features_from_s3(ticker, target_date_iso)
 
         if df_features.empty:
             raise ValueError("Feature file is empty.")
         if len(df_features) > 1:
             print(f"WARN: Feature file contains multiple rows ({len(df_features)}). Using the first row only.")
 
-        # Prepare payload for SageMaker endpoint 
-        # Exclude header, get first row as comma-separated string
-        feature_payload_string = df_features.to_csv(header=False, index=False).splitlines()[0]
-
-        features_dict_for_ddb = df_features.iloc[0].to_dict()
+        # Prepare payload for SageMaker endpoint (first row; numpy scalars -> plain Python for JSON)
+        row = df_features.iloc[0]
+        features_dict_for_ddb = {c: v.item() if hasattr(v, 'item') else v for c, v in zip(df_features.columns, row.values)}
 
         payload = {"features": features_dict_for_ddb}
+        # Same row, compressed, rides along with the prediction so shap_explainer skips its S3 read
+        features_blob = base64.b64encode(zlib.compress(json.dumps(features_dict_for_ddb).encode())).decode()
         payload_json = json.dumps(payload) # Convert dictionary to JSON string
 
 
     except ClientError as e:
-        if e.response['Error']['Code'] == 'NoSuchKey':
-            print(f"ERROR: Feature file not found: {feature_s3_key}")
+        feature_s3_key = getattr(e, 's3_key', feature_s3_key) # The key that actually failed
+        if e.response['Error']['Code'] in MISSING_OBJECT_CODES:
+            print(f"ERROR: Feature file not found: {feature_s3_key} ({e.response['Error']['Code']})")
             return {
                 'statusCode': 404,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -124,74 +177,66 @@ def lambda_handler(event, context):
         print(f"ERROR parsing SageMaker response or other invocation error: {e}")
         return {'statusCode': 500, 'body': json.dumps({"error": f"SageMaker Invocation Error: {e}"})}
 
-    # --- 4. Save Prediction to DynamoDB (Triggers Downstream) ---
+    # --- 4. Save Prediction to DynamoDB first (the explainer reads its metrics once the shap item lands) ---
     ddb_pk = f"{ticker}_{target_date_iso}"
     print(f"Saving prediction to DynamoDB (Key: {ddb_pk})...")
     try:
+        ingested_at = datetime.utcnow().isoformat() + "Z"
         item_to_write = {
             'ticker_date': ddb_pk,# Partition Key
             'datatype': 'prediction',# Sort Key 
+            'ticker': ticker, # TickerDatatypeIndex PK (get-history)
+            'datatype_sk': f"prediction#{ingested_at}", # TickerDatatypeIndex SK
             'prediction': direction,
             'confidence': f"{confidence:.4f}",       
             'probability_up': f"{prob_up:.4f}",      
             'model_version': MODEL_VERSION_TAG,
             'features_s3_path': f"s3://{CURATED_BUCKET}/{feature_s3_key}", 
-            'ingested_at': datetime.utcnow().isoformat() + "Z",
-            'data_found_for': target_date_iso 
+            'ingested_at': ingested_at,
+            'data_found_for': target_date_iso,
+            'features_blob': features_blob, # zlib + base64 JSON of the feature row (read by shap_explainer)
+            'shap_inline': bool(SHAP_FUNCTION_NAME) # SHAP computed by the synchronous call below; the stream record is skipped
         }
         table.put_item(Item=item_to_write)
         print("Prediction saved successfully to DynamoDB.")
     except Exception as e:
         print(f"ERROR saving prediction to DynamoDB for {ddb_pk}: {e}")
 
-    # --- 5. Retrieve SHAP and Explanation Data ---
-    
-    WAIT_TIME_SECONDS = 3 
-    MAX_RETRIES = 5
-    
-    print(f"Waiting for {WAIT_TIME_SECONDS} seconds for downstream processes (SHAP/Bedrock) to run...")
-    time.sleep(WAIT_TIME_SECONDS) 
-
-    shap_metrics = {}
-    explanation_text = "Explanation not yet available."
-
-    for attempt in range(MAX_RETRIES):
-        print(f"Attempt {attempt + 1}: Querying DynamoDB for SHAP and Explanation data...")
+    # --- 4b. SHAP via synchronous invoke (also writes the shap item that triggers Bedrock) ---
+    shap_metrics = invoke_shap(ticker, target_date_iso, features_blob) if SHAP_FUNCTION_NAME else {}
+    if SHAP_FUNCTION_NAME and not shap_metrics:
+        # Hand the record back to the stream path: the MODIFY event re-triggers shap_explainer
         try:
-            response = table.query(
-                KeyConditionExpression=boto3.dynamodb.conditions.Key('ticker_date').eq(ddb_pk)
-            )
-            
-            for item in response.get('Items', []):
-                
-                # Check for SHAP item and read top-level fields
-                if item.get('datatype') == 'shap':
-                    top_features = item.get('top_features')
-                    values = item.get('values')
-                    
-                    if top_features and values:
-                        # Build the shap_metrics object manually
-                        shap_metrics = {
-                            "top_features": top_features,
-                            "values": values
-                        }
-                        print("[INFO] Found SHAP data.")
-
-                elif item.get('datatype') == 'explanation' and 'explanation_text' in item:
-                    explanation_text = item.get('explanation_text', 'No explanation text found.')
-                    print("[INFO] Found Explanation text.")
-            
-            if shap_metrics and explanation_text != "Explanation not yet available.":
-                print("Found both SHAP metrics and Explanation text.")
-                break 
-            
+            table.update_item(Key={'ticker_date': ddb_pk, 'datatype': 'prediction'},
+                              UpdateExpression='SET shap_inline = :f', ExpressionAttributeValues={':f': False},
+                              ConditionExpression='attribute_exists(ticker_date)') # Never create a stub prediction
         except Exception as e:
-            print(f"ERROR querying DynamoDB for SHAP/Explanation: {e}")
+            print(f"ERROR re-queueing SHAP for {ddb_pk}: {e}")
 
-        if attempt < MAX_RETRIES - 1:
-            time.sleep(1) 
-        else:
-            print("Failed to retrieve both SHAP and Explanation after max retries.")
+    # --- 5. Retrieve Explanation (bounded poll) and SHAP Data (projected get_items) ---
+    # The shap item written by the synchronous call triggers Bedrock via the stream; wait for its
+    # explanation, but never past the API budget. Without a fresh shap item, only read once.
+    explanation_text = "Explanation not yet available."
+    wait_until = min(time.monotonic() + EXPLANATION_WAIT_SECONDS, started + API_TIME_BUDGET_SECONDS) if shap_metrics else 0
+    try:
+        while True:
+            expl_item = table.get_item(Key={'ticker_date': ddb_pk, 'datatype': 'explanation'},
+                                       ProjectionExpression='explanation_text', ConsistentRead=True).get('Item') or {}
+            if 'explanation_text' in expl_item:
+                explanation_text = expl_item['explanation_text']
+                print("[INFO] Found Explanation text.")
+                break
+            if time.monotonic() + EXPLANATION_POLL_INTERVAL > wait_until: break
+            time.sleep(EXPLANATION_POLL_INTERVAL)
+        # Fall back to a stored SHAP item only if the synchronous call was skipped or failed
+        shap_item = {} if shap_metrics else table.get_item(
+            Key={'ticker_date': ddb_pk, 'datatype': 'shap'},
+            ProjectionExpression='top_features, #v', ExpressionAttributeNames={'#v': 'values'}).get('Item') or {}
+        if shap_item.get('top_features') and shap_item.get('values'):
+            shap_metrics = {"top_features": shap_item['top_features'], "values": shap_item['values']}
+            print("[INFO] Found SHAP data.")
+    except Exception as e:
+        print(f"ERROR reading SHAP/Explanation from DynamoDB: {e}")
 
     # --- 6. Return API Response ---
     api_response = {
@@ -203,7 +248,8 @@ def lambda_handler(event, context):
         "model_explanation": explanation_text,
         "shap_metrics": shap_metrics 
     }
-    print("Returning API response with explanation and SHAP:", json.dumps(api_response))
+    response_body = orjson.dumps(api_response).decode()
+    print("Returning API response with explanation and SHAP:", response_body)
 
     return {
         'statusCode': 200,
@@ -211,5 +257,5 @@ def lambda_handler(event, context):
             'Content-Type': 'application/json',
             'Access-Control-Allow-Origin': '*' 
         },
-        'body': json.dumps(api_response)
+        'body': response_body
     }
\ No newline at end of file
@@ -1,9 +1,8 @@
-import xgboost as xgb
-import joblib, shap, os, io, json, boto3, tarfile
-import pandas as pd
+import os, io, json, boto3, tarfile, zlib, base64
 from datetime import datetime, timedelta
 import tempfile 
 from boto3.dynamodb.types import TypeDeserializer # <-- NEW IMPORT
+from botocore.config import Config
 
 # --- Config ---
 S3_BUCKET = os.getenv("S3_BUCKET", "ai-trading-copilot-curated") # For features
@@ -13,29 +12,74 @@ REGION = os.getenv("AWS_REGION", "us-east-1")
 # --- Specific path for the SageMaker model ---
 MODEL_S3_BUCKET = "sagemaker-us-east-1-<account-id>" 
 MODEL_S3_KEY = "stock-model-tuning/stock-xgb-tuning-251018-0001-005-a1482f12/output/model.tar.gz"
+# Pre-extracted model archive baked into the image (see dockerfile); S3 download + untar only if it's empty
+MODEL_LOCAL_DIR = os.getenv("MODEL_LOCAL_DIR", "/opt/model")
 
-# --- AWS Clients ---
-s3 = boto3.client("s3", region_name=REGION)
-ddb = boto3.resource("dynamodb", region_name=REGION)
+# --- AWS Clients (keep-alive connections reused across warm invocations, fail-fast timeouts) ---
+BOTO_CONFIG = Config(retries={'mode': 'adaptive', 'max_attempts': 3}, max_pool_connections=10, tcp_keepalive=True, connect_timeout=1, read_timeout=3)
+s3 = boto3.client("s3", region_name=REGION, config=BOTO_CONFIG)
+ddb = boto3.resource("dynamodb", region_name=REGION, config=BOTO_CONFIG)
 table = ddb.Table(DDB_TABLE)
 
+# --- Heavy imports, deferred until a record actually needs them (filtered-out batches never pay for them) ---
+xgb = np = pd = None
+
+def _import_heavy():
+    global xgb, np, pd
+    if xgb is None:
+        import xgboost as xgb
+        import numpy as np
+        import pandas as pd
 
 # --- helper: build the new features path ---
-def feature_key_for(ticker: str, date_str: str) -> str:
-    # filenames look like AAPL_features.csv, AMZN_features.csv, etc.
-    fname = f"{ticker.upper()}_features.csv"
+def feature_key_for(ticker: str, date_str: str, ext: str = "parquet") -> str:
+    # filenames look like AAPL_features.parquet, AMZN_features.parquet, etc. (.csv before the Parquet switch)
+    fname = f"{ticker.upper()}_features.{ext}"
     return f"features/daily_inference/{date_str}/{fname}"
 
 # --- Helper: read CSV from S3 ---
 def read_csv_from_s3(bucket, key):
-    obj = s3.get_object(Bucket=bucket, Key=key)
-    return pd.read_csv(io.BytesIO(obj["Body"].read()))
+    return pd.read_csv(s3.get_object(Bucket=bucket, Key=key)["Body"]) # Parse straight from the StreamingBody
+
+# --- Helper: read features from S3 (Parquet, falling back to legacy CSV) ---
+def read_features_from_s3(bucket, ticker, date_str):
+    key = feature_key_for(ticker, date_str)
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=key)
+        return pd.read_parquet(io.BytesIO(obj["Body"].read())), key
+    except s3.exceptions.ClientError as e:
+        # Without s3:ListBucket a missing key comes back as AccessDenied rather than NoSuchKey
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "AccessDenied"): raise
+    key = feature_key_for(ticker, date_str, "csv")
+    print(f"[INFO] Parquet features not readable, trying s3://{bucket}/{key}")
+    return read_csv_from_s3(bucket, key), key
+
+# --- Helper: booster from a model directory (native file, else the training script's pickle) ---
+def load_booster_from_dir(model_dir):
+    """
+    Returns an xgb.Booster from 'xgboost-model' in model_dir or, for artifacts trained before
+    final_model.py also saved the native file, from the joblib-pickled 'model.pkl' wrapper.
+    """
+    model_path = os.path.join(model_dir, "xgboost-model")
+    if os.path.exists(model_path):
+        print(f"[INFO] Loading '{model_path}' (XGBoost booster format)")
+        booster = xgb.Booster()
+        booster.load_model(model_path)
+        return booster
+    pkl_path = os.path.join(model_dir, "model.pkl")
+    if os.path.exists(pkl_path):
+        import joblib # Only this legacy path needs it: joblib pickles store numpy arrays in its own format
+        print(f"[INFO] No 'xgboost-model'; loading booster from pickled wrapper '{pkl_path}'")
+        return joblib.load(pkl_path).get_booster()
+    raise FileNotFoundError(
+        f"No 'xgboost-model' or 'model.pkl' in {model_dir}. Deploy a model artifact produced by model/final_model.py."
+    )
 
-# --- Helper: universal model loader from S3 ---
+# --- Helper: native XGBoost model loader from S3 ---
 def load_model_safely(s3_client, bucket, key):
     """
-    Load a model from a .tar.gz archive (SageMaker output) from S3.
-    Extracts the archive to the OS's temp directory and loads the model file.
+    Load the XGBoost booster from a .tar.gz archive (SageMaker output) from S3.
+    Extracts the archive to the OS's temp directory and loads 'xgboost-model' (or 'model.pkl').
     """
     temp_dir = tempfile.gettempdir()
     local_tar_path = os.path.join(temp_dir, "model.tar.gz")
@@ -57,37 +101,8 @@ def load_model_safely(s3_client, bucket, key):
             
         print(f"[INFO] Extracted files: {os.listdir(local_extract_dir)}")
 
-        # 3. Try loading the native XGBoost model (SageMaker default)
-        model_path = os.path.join(local_extract_dir, "xgboost-model")
-        if os.path.exists(model_path):
-            print("[INFO] Loading 'xgboost-model' (XGBoost booster format)")
-            booster = xgb.Booster()
-            booster.load_model(model_path)
-            return booster, "json" 
-
-        # 4. Try loading a .json model
-        model_path = os.path.join(local_extract_dir, "model.json")
-        if os.path.exists(model_path):
-            print("[INFO] Loading 'model.json' (XGBoost booster format)")
-            booster = xgb.Booster()
-            booster.load_model(model_path)
-            return booster, "json"
-
-        # 5. Try loading a .joblib model (SKLearn wrapper)
-        model_path = os.path.join(local_extract_dir, "model.joblib")
-        if os.path.exists(model_path):
-            print("[INFO] Loading 'model.joblib' (pickled sklearn wrapper)")
-            model = joblib.load(model_path)
-            return model, "joblib"
-            
-        # 6. Try loading a .pkl model (generic pickle)
-        model_path = os.path.join(local_extract_dir, "model.pkl")
-        if os.path.exists(model_path):
-            print("[INFO] Loading 'model.pkl' (pickled file)")
-            model = joblib.load(model_path) # Use joblib to load pickle
-            return model, "joblib" # Treat as joblib type for SHAP
-            
-        raise FileNotFoundError(f"No valid model file (xgboost-model, model.json, model.joblib, or model.pkl) found in archive.")
+        # 3. Load the native XGBoost model (SageMaker default), else the pickled wrapper's booster
+        return load_booster_from_dir(local_extract_dir)
 
     except s3_client.exceptions.ClientError as e:
         print(f"[ERROR] Could not download model from S3: {e}")
@@ -96,6 +111,90 @@ def load_model_safely(s3_client, bucket, key):
         print(f"[ERROR] Failed to load model: {e}")
         raise
 
+# --- Model cached per container (lazy, survives warm invocations) ---
+_MODEL = None
+
+def _get_model():
+    global _MODEL
+    if _MODEL is None:
+        _import_heavy()
+        if any(os.path.exists(os.path.join(MODEL_LOCAL_DIR, f)) for f in ("xgboost-model", "model.pkl")):
+            print(f"[INFO] Loading pre-extracted model from {MODEL_LOCAL_DIR}")
+            model = load_booster_from_dir(MODEL_LOCAL_DIR)
+        else:
+            model = load_model_safely(s3, MODEL_S3_BUCKET, MODEL_S3_KEY)
+        _MODEL = model
+    return _MODEL
+
+# --- Helper: decode the feature row inference-caller attaches to the prediction (zlib + base64 JSON) ---
+def decode_features_blob(blob):
+    return json.loads(zlib.decompress(base64.b64decode(blob)))
+
+# --- Helper: feature frame for one ticker/date (shared by stream and direct invocation) ---
+def load_features(ticker, asof, data_found_for, features_blob=None):
+    """Returns the feature DataFrame (id columns dropped). Raises if the feature file can't be loaded."""
+    _import_heavy()
+    if features_blob:
+        # Feature row travelled with the prediction: no S3 read
+        df = pd.DataFrame([decode_features_blob(features_blob)])
+        print(f"[INFO] Using features attached to the prediction for {ticker}_{asof}")
+    else:
+        # Load feature data from S3 (--- NO LOOKBACK ---), e.g. for backfilled predictions
+        # We load the *exact* file the prediction was based on.
+        df, key = read_features_from_s3(S3_BUCKET, ticker, data_found_for)
+        print(f"[INFO] Success: Loaded from S3: s3://{S3_BUCKET}/{key}")
+    if df.empty:
+        raise ValueError("Feature file is empty.")
+
+    drop_cols = ["target_up", "symbol", "asof", "date"]
+    return df.drop(columns=[c for c in drop_cols if c in df.columns], errors="ignore")
+
+# --- Helper: SHAP top factors for a batch of records with one pred_contribs call ---
+def explain_batch(model, batch):
+    """batch: [(ticker, asof, data_found_for, df), ...]. Returns [(shap_item, result), ...] in the same order."""
+    expected = model.feature_names
+    if expected is None or len(expected) == 0:
+        expected = list(batch[0][3].columns)
+
+    # Stack every record's rows; single pass to model column order, missing features as NaN, float32
+    X = pd.concat([b[3] for b in batch], ignore_index=True).reindex(columns=expected, fill_value=np.nan).astype(np.float32, copy=False)
+    offsets = np.cumsum([0] + [len(b[3]) for b in batch])
+
+    print(f"[DEBUG] X shape after re-aligning: {X.shape}")
+
+    # Compute SHAP: native TreeSHAP, plain (rows, features + bias) array, one multithreaded call for the batch.
+    # Columns are already in model order, so the DMatrix carries no feature names and skips name validation
+    dm = xgb.DMatrix(X.to_numpy(), missing=np.nan)
+    contribs = model.predict(dm, pred_contribs=True, validate_features=False)[:, :-1] # Last column is the bias term
+
+    now_iso = datetime.utcnow().isoformat() + "Z" # One timestamp for the whole batch
+    out = []
+    for (ticker, asof, data_found_for, _), lo, hi in zip(batch, offsets[:-1], offsets[1:]):
+        # Top 5 by mean |SHAP|: O(n) partition, then order only those 5
+        abs_means = np.abs(contribs[lo:hi]).mean(axis=0)
+        idx = np.argpartition(-abs_means, min(5, len(abs_means) - 1))[:5]
+        idx = idx[np.argsort(-abs_means[idx], kind="stable")]
+        top_features = [(X.columns[i], float(abs_means[i])) for i in idx]
+
+        print(f"[RESULT] Top SHAP features for {ticker}_{asof}: {top_features}")
+
+        shap_item = {
+            "ticker_date": f"{ticker}_{asof}", # Use the original 'asof' date for the key
+            "datatype": "shap",
+            "top_features": [f[0] for f in top_features], 
+            "values": [str(f[1]) for f in top_features],
+            "data_found_for": data_found_for, # Record which day's features we used
+            "ingested_at": now_iso
+        }
+        result = {
+            "ticker": ticker,
+            "asof": asof,
+            "data_found_for": data_found_for,
+            "top_factors": [[feature, float(value)] for feature, value in top_features]
+        }
+        out.append((shap_item, result))
+    return out
+
 # --- Main Lambda handler ---
 def lambda_handler(event, context):
     
@@ -104,15 +203,27 @@ def lambda_handler(event, context):
     # --- Helper to deserialize DDB stream records ---
     ddb_deserializer = TypeDeserializer()
 
-    # Load model from S3 (once per invocation)
-    try:
-        model, mtype = load_model_safely(s3, MODEL_S3_BUCKET, MODEL_S3_KEY)
-        print("[INFO] Model loaded successfully.")
-    except Exception as e:
-        print(f"[FATAL] Could not load model. Stopping invocation. Error: {e}")
-        return {"statusCode": 500, "body": "Failed to load model"}
+    # --- Direct (RequestResponse) invocation from inference-caller: {"ticker", "data_found_for"[, "asof", "features_blob"]} ---
+    if "Records" not in event and "ticker" in event:
+        ticker = event["ticker"].upper()
+        data_found_for = event["data_found_for"]
+        asof = event.get("asof", data_found_for)
+        try:
+            model = _get_model()
+        except Exception as e:
+            print(f"[FATAL] Could not load model. Stopping invocation. Error: {e}")
+            return {"statusCode": 500, "body": "Failed to load model"}
+        try:
+            df = load_features(ticker, asof, data_found_for, event.get("features_blob"))
+            (shap_item, result), = explain_batch(model, [(ticker, asof, data_found_for, df)])
+        except Exception as e:
+            print(f"[ERROR] Could not explain {ticker}_{asof}: {e}")
+            return {"statusCode": 500, "body": json.dumps({"error": f"SHAP Error: {e}"})}
+        table.put_item(Item=shap_item) # Still written so the Bedrock explainer is triggered from the stream
+        print(f"[INFO] Saved SHAP explanation to DynamoDB for {ticker}_{asof}")
+        return {"statusCode": 200, "body": json.dumps(result)}
 
-    processed_count = 0
+    batch = []
     
     # --- Process each record from the stream ---
     for record in event.get("Records", []):
@@ -132,6 +243,9 @@ def lambda_handler(event, context):
         if item.get("datatype") != "prediction":
             print(f"[INFO] Skipping item, not 'prediction' datatype.")
             continue
+        if item.get("shap_inline"):
+            print(f"[INFO] Skipping {item.get('ticker_date')}, SHAP already computed by the synchronous call.")
+            continue
 
         try:
             # 1.4 Get Ticker and Date from the prediction item
@@ -151,93 +265,45 @@ def lambda_handler(event, context):
             print(f"[ERROR] Failed to parse prediction record: {e}. Record: {item}")
             continue # Skip this broken record
 
-        # Load feature data from S3 (--- NO LOOKBACK ---)
-        # We load the *exact* file the prediction was based on.
-        key = feature_key_for(ticker, data_found_for)
-
+        # Load feature data (attached blob or S3); SHAP runs once for the whole batch after the loop
         try:
-            df = read_csv_from_s3(S3_BUCKET, key)
-            print(f"[INFO] Success: Loaded from S3: s3://{S3_BUCKET}/{key}")
+            batch.append((ticker, asof, data_found_for, load_features(ticker, asof, data_found_for, item.get("features_blob"))))
         except Exception as e:
-            print(f"[ERROR] Could not load features for {ticker_date_key} from {key}: {e}")
+            print(f"[ERROR] Could not load features for {ticker_date_key} from {data_found_for}: {e}")
             continue  # Skip this record
 
-        # Clean + align features
-        drop_cols = ["target_up", "symbol", "asof", "date"]
-        df = df.drop(columns=[c for c in drop_cols if c in df.columns], errors="ignore")
-
-        if mtype == "joblib":
-            try:
-                expected = model.get_booster().feature_names
-            except Exception:
-                try:
-                    expected = model.feature_names_in_
-                except AttributeError:
-                    print("[WARNING] Could not automatically get model feature names. Using columns from data.")
-                    expected = list(df.columns)
-        else:  # booster JSON model
-            expected = model.feature_names
-            if expected is None or len(expected) == 0:
-                expected = list(df.columns)
-
-        X = df[[f for f in expected if f in df.columns]].astype(float)
-        
-        missing_in_df = set(expected) - set(X.columns)
-        if missing_in_df:
-            print(f"[WARNING] Model expected features not in data: {missing_in_df}")
-            X = X.reindex(columns=expected) # Fill missing with NaN
-
-        print(f"[DEBUG] X shape after re-aligning: {X.shape}")
-
-        # Compute SHAP
-        if mtype == "json":
-            explainer = shap.Explainer(model)
-        else:
-            if isinstance(model, (xgb.XGBClassifier, xgb.XGBRegressor)):
-                 explainer = shap.TreeExplainer(model)
-            else:
-                print("[INFO] 'joblib' model is not a standard XGB wrapper. Using shap.Explainer (may be slower).")
-                explainer = shap.Explainer(model.predict, X) 
-
-        shap_values = explainer(X)
-        
-        shap_vals_data = shap_values.values
-        if isinstance(shap_vals_data, list) and len(shap_vals_data) > 1:
-            print("[INFO] Classifier model detected, using SHAP values for the positive class.")
-            shap_vals_data = shap_vals_data[1] 
-
-        mean_abs = dict(zip(X.columns, abs(shap_vals_data).mean(axis=0)))
-        top_features = sorted(mean_abs.items(), key=lambda x: x[1], reverse=True)[:5]
+    # Load model (once per container) and compute SHAP for every queued record in one batched predict
+    if batch:
+        try:
+            model = _get_model()
+            print("[INFO] Model loaded successfully.")
+        except Exception as e:
+            print(f"[FATAL] Could not load model. Stopping invocation. Error: {e}")
+            return {"statusCode": 500, "body": "Failed to load model"}
+    try:
+        explained = explain_batch(model, batch) if batch else []
+    except Exception as e:
+        print(f"[ERROR] Batched SHAP computation failed for {len(batch)} records: {e}")
+        return {"statusCode": 500, "body": json.dumps({"error": f"SHAP Error: {e}"})}
+    shap_items = [shap_item for shap_item, _ in explained]
+    results = [result for _, result in explained]
 
-        print(f"[RESULT] Top SHAP features: {top_features}")
+    # Save to DynamoDB: one BatchWriter for the whole stream batch (25 items per BatchWriteItem)
+    if shap_items:
+        with table.batch_writer(overwrite_by_pkeys=["ticker_date", "datatype"]) as bw:
+            for shap_item in shap_items:
+                bw.put_item(Item=shap_item)
+        print(f"[INFO] Saved {len(shap_items)} SHAP explanations to DynamoDB.")
 
-        # Save to DynamoDB
-        # This saves the *new* 'shap' item
-        item = {
-            "ticker_date": f"{ticker}_{asof}", # Use the original 'asof' date for the key
-            "datatype": "shap",
-            "top_features": [f[0] for f in top_features], 
-            "values": [str(f[1]) for f in top_features],
-            "data_found_for": data_found_for, # Record which day's features we used
-            "ingested_at": datetime.utcnow().isoformat() + "Z"
-        }
-        table.put_item(Item=item)
-        print(f"[INFO] Saved SHAP explanation to DynamoDB for {ticker}_{asof}")
-        processed_count += 1
-
-        json_top_factors = [[feature, float(value)] for feature, value in top_features]
-
-        # Return result
-        return {
-            "statusCode": 200,
-            "headers": {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*' 
-            },
-            "body": json.dumps({
-                "ticker": ticker,
-                "asof": asof,
-                "data_found_for": data_found_for,
-                "top_factors": json_top_factors
-            })
-        }
\ No newline at end of file
+    # Return aggregated result for the whole batch
+    return {
+        "statusCode": 200,
+        "headers": {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*' 
+        },
+        "body": json.dumps({
+            "processed_count": len(results),
+            "results": results
+        })
+    }
\ No newline at end of file
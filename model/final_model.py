@@ -1,15 +1,22 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pac
 import xgboost as xgb
 import joblib
 import os
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.metrics import accuracy_score
 
 def train_model(feature_path, model_output_path, **hyperparameters):
     
     feature_files = [os.path.join(feature_path, f) for f in os.listdir(feature_path) if f.endswith('_features.csv')]
-    all_features_df = pd.concat((pd.read_csv(f) for f in feature_files), ignore_index=True)
-    all_features_df['date'] = pd.to_datetime(all_features_df['date'])
+    # Arrow CSV parse (GIL released), files read in parallel, one concat, one conversion to pandas
+    convert_options = pac.ConvertOptions(column_types={'date': pa.timestamp('ns')})
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+        tables = list(ex.map(lambda f: pac.read_csv(f, convert_options=convert_options), feature_files))
+    all_features_df = pa.concat_tables(tables, promote_options='permissive').to_pandas()
     all_features_df = all_features_df.sort_values(by=['date', 'symbol']).reset_index(drop=True)
 
     all_features_df['target'] = (all_features_df.groupby('symbol')['close'].shift(-1) > all_features_df['close']).astype(int)
@@ -17,8 +24,9 @@ def train_model(feature_path, model_output_path, **hyperparameters):
     features = [col for col in all_features_df.columns if col not in ['date', 'open', 'high', 'low', 'close', 'volume', 'symbol', 'asof', 'target']]
     final_df = all_features_df.dropna(subset=features + ['target'])
     
-    X = final_df[features]
-    y = final_df['target']
+    # Plain float32 / int8 arrays: no pandas->numpy conversion inside xgboost, half the matrix memory
+    X = final_df[features].to_numpy(dtype=np.float32)
+    y = final_df['target'].to_numpy(dtype=np.int8)
 
     split_index = int(len(final_df) * 0.8)
     X_train, X_test = X[:split_index], X[split_index:]
@@ -30,11 +38,15 @@ def train_model(feature_path, model_output_path, **hyperparameters):
         objective='binary:logistic',
         eval_metric='auc', # The tuner will look for this metric
         use_label_encoder=False,
+        tree_method='hist', # Histogram split finding: much faster than 'exact' on real data sizes
+        n_jobs=-1,
         **hyperparameters # Pass the tuner's hyperparameters here
     )
     
     # Provide an evaluation set for the tuner to monitor
     model.fit(X_train, y_train, eval_set=[(X_test, y_test)], verbose=False)
+    # Arrays carry no column names; keep them on the booster for the endpoint and the SHAP lambda
+    model.get_booster().feature_names = features
 
     preds = model.predict(X_test)
     accuracy = accuracy_score(y_test, preds)
@@ -42,6 +54,8 @@ def train_model(feature_path, model_output_path, **hyperparameters):
 
     model_filename = os.path.join(model_output_path, "model.pkl")
     joblib.dump(model, model_filename)
+    # Native booster too: the SHAP lambda loads only 'xgboost-model'
+    model.get_booster().save_model(os.path.join(model_output_path, "xgboost-model"))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
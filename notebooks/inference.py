@@ -1,11 +1,12 @@
 import joblib
 import os
 import json
-import pandas as pd
+import numpy as np
 import xgboost as xgb # Required for XGBoost model
 
 # Global variable for model assets
 LOADED_MODEL_ASSETS = None
+PREDICT_NTHREAD = 1 # Single-row predictions: an OpenMP team per call is pure overhead (and contends across workers)
 
 # Called once when the container starts
 def model_fn(model_dir):
@@ -30,6 +31,11 @@ def model_fn(model_dir):
     else:
         raise FileNotFoundError(f"Could not find model.pkl or xgboost-model in {model_dir}")
 
+    # Pin prediction to one thread once, at load
+    if isinstance(model, xgb.Booster): model.set_param({'nthread': PREDICT_NTHREAD})
+    elif hasattr(model, 'get_booster'):
+        model.set_params(n_jobs=PREDICT_NTHREAD)
+        model.get_booster().set_param({'nthread': PREDICT_NTHREAD})
     print("Model loaded successfully.")
 
     # --- Define Expected Features ---
@@ -66,30 +72,30 @@ def predict_fn(input_features_dict, model_assets):
     print(f"Received features for prediction: {input_features_dict}")
 
     try:
-        # Create DataFrame and align features
-        X = pd.DataFrame([input_features_dict]).reindex(columns=expected_features)
-        if X.isnull().values.any():
-             missing_cols = X.columns[X.isnull().any()].tolist()
+        # Build the float32 row in model order straight from the dict (per call, so workers stay reentrant);
+        # missing/None values become NaN and are zeroed in one masked pass
+        row = np.array([[input_features_dict.get(name) for name in expected_features]], dtype=np.float32)
+        nan_mask = np.isnan(row)
+        if nan_mask.any():
+             missing_cols = [expected_features[i] for i in np.flatnonzero(nan_mask)] # Names only on the slow path
              print(f"Warning: Features missing/NaN: {missing_cols}. Filling with 0.")
-             X = X.fillna(0)
-        X = X.astype(float)
-        print(f"Input DataFrame shape for prediction: {X.shape}")
+             row[nan_mask] = 0.0
+        print(f"Input row shape for prediction: {row.shape}")
 
     except Exception as e:
-         raise ValueError(f"Error creating DataFrame from input features: {e}")
+         raise ValueError(f"Error building feature row from input features: {e}")
 
     # Make prediction based on model type
     print("Predicting probabilities...")
     if isinstance(model, xgb.Booster):
-        # Booster needs DMatrix
-        print("Using Booster.predict()")
-        xgb_input = xgb.DMatrix(X, feature_names=expected_features)
-        prob_class_1 = model.predict(xgb_input)[0] # Gives prob of positive class
+        # inplace_predict on the float32 row: no per-request DMatrix build
+        print("Using Booster.inplace_predict()")
+        prob_class_1 = float(model.inplace_predict(row)[0]) # Gives prob of positive class
         prob_class_0 = 1.0 - prob_class_1
         prediction_output = [prob_class_0, prob_class_1]
     elif hasattr(model, 'predict_proba'): # Check if it's the sklearn wrapper
         print("Using sklearn wrapper predict_proba()")
-        prediction_output = model.predict_proba(X)[0] # Gives [prob_0, prob_1]
+        prediction_output = model.predict_proba(row)[0] # Gives [prob_0, prob_1]
     else:
         raise TypeError("Loaded model is not a recognized XGBoost Booster or sklearn wrapper.")
 
@@ -98,7 +104,6 @@ def predict_fn(input_features_dict, model_assets):
 # Output formatting (remains the same - handles JSON conversion)
 def output_fn(prediction_output, accept):
     """Formats the prediction output probability array into JSON."""
-    import numpy as np # Need numpy for float conversion check
     print(f"Formatting prediction for accept type: {accept}")
     if accept == "application/json":
         try:
@@ -1,7 +1,9 @@
-import os, argparse
+import os, time, argparse
 import pandas as pd
 import numpy as np
 import boto3
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, datetime
 
 # --- Constants & AWS Clients ---
@@ -9,42 +11,183 @@ LOCAL_INPUT_PATH = "/opt/ml/processing/input/raw-data"
 LOCAL_OUTPUT_PATH = "/opt/ml/processing/output"
 REGION = os.environ.get("AWS_REGION", "us-east-1")
 
-dynamodb = boto3.resource("dynamodb", region_name=REGION)
-table = dynamodb.Table("TradingCopilot") 
+DDB_TABLE = "TradingCopilot"
+DDB_BATCH_GET_LIMIT = 100 # BatchGetItem per-request key limit
+DDB_BATCH_GET_MAX_RETRIES = 5
+DDB_BATCH_GET_WORKERS = 16
+NEWS_METRIC_DEFAULTS = {
+    'avg_sentiment_24h': 0.0, 'news_count_24h': 0,
+    'positive_count_24h': 0, 'negative_count_24h': 0,
+    'sentiment_std_24h': 0.0
+}
+NEWS_METRIC_ATTRS = { # Feature column -> news_metrics item attribute
+    'avg_sentiment_24h': 'avg_sentiment_24h', 'news_count_24h': 'count_24h',
+    'positive_count_24h': 'positive_count_24h', 'negative_count_24h': 'negative_count_24h',
+    'sentiment_std_24h': 'sentiment_std_24h'
+}
 
-def read_news_metrics_from_dynamodb(symbol, date_iso):
+# --- JIT (numba if installed, else the kernels run as plain Python) ---
+os.environ.setdefault('NUMBA_CACHE_DIR', '/tmp/numba_cache')
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]): return args[0]
+        return lambda fn: fn
+
+# One session per process; pool sized for the concurrent BatchGetItem workers
+BOTO_CONFIG = Config(retries={'mode': 'adaptive', 'max_attempts': 10}, max_pool_connections=64, tcp_keepalive=True)
+session = boto3.Session(region_name=REGION)
+ddb_client = session.client("dynamodb", config=BOTO_CONFIG) # Low-level client is thread-safe (resources are not)
+
+def _batch_get_news_metrics(keys):
+    """One BatchGetItem call (<= 100 keys) plus UnprocessedKeys retries. Returns the raw (wire-format) items."""
+    items = []
+    request = {DDB_TABLE: {
+        'Keys': keys,
+        'ProjectionExpression': ', '.join(['ticker_date', *NEWS_METRIC_ATTRS.values()])
+    }}
+    for attempt in range(DDB_BATCH_GET_MAX_RETRIES):
+        response = ddb_client.batch_get_item(RequestItems=request)
+        items.extend(response.get('Responses', {}).get(DDB_TABLE, []))
+        request = response.get('UnprocessedKeys')
+        if not request: break
+        time.sleep(0.05 * (2 ** attempt)) # Exponential backoff on throttled keys
+    return items
+
+def _wire_text(attr):
+    """Text of a raw S/N attribute (numbers arrive as strings on the wire), or None if absent."""
+    return next(iter(attr.values())) if attr else None
+
+def read_news_metrics_from_dynamodb(symbol, date_isos):
     """
-    Fetches detailed processed news metrics from DynamoDB.
+    Fetches detailed processed news metrics from DynamoDB for many days with BatchGetItem,
+    running the 100-key batches concurrently.
+    Returns {column: array aligned with date_isos}, NEWS_METRIC_DEFAULTS filling days without an item.
     """
+    pks = (f"{symbol}_" + pd.Series(date_isos, dtype=object)).to_numpy() # Vectorized ticker_date build
+    keys = [{'ticker_date': {'S': pk}, 'datatype': {'S': 'news_metrics'}} for pk in pd.unique(pks)] # Duplicate keys are rejected
+    batches = [keys[i:i + DDB_BATCH_GET_LIMIT] for i in range(0, len(keys), DDB_BATCH_GET_LIMIT)]
+    items = []
     try:
-        pk = f"{symbol}_{date_iso}"
-        response = table.get_item(
-            Key={'ticker_date': pk, 'datatype': 'news_metrics'}
-        )
-
-        if 'Item' in response:
-            item = response['Item']
-            metrics = {
-                'avg_sentiment_24h': float(item.get('avg_sentiment_24h', '0.0')),
-                'news_count_24h': int(item.get('count_24h', 0)),
-                'positive_count_24h': int(item.get('positive_count_24h', 0)), # New
-                'negative_count_24h': int(item.get('negative_count_24h', 0)), # New
-                'sentiment_std_24h': float(item.get('sentiment_std_24h', '0.0')) # New
-            }
-            return metrics
-        else:
-            # Return defaults for all metrics if item not found
-            return {
-                'avg_sentiment_24h': 0.0, 'news_count_24h': 0,
-                'positive_count_24h': 0, 'negative_count_24h': 0,
-                'sentiment_std_24h': 0.0
-            }
+        if len(batches) == 1:
+            items = _batch_get_news_metrics(batches[0])
+        elif batches:
+            with ThreadPoolExecutor(max_workers=min(len(batches), DDB_BATCH_GET_WORKERS)) as ex:
+                for part in ex.map(_batch_get_news_metrics, batches): items.extend(part)
     except Exception as e:
-        return {
-            'avg_sentiment_24h': 0.0, 'news_count_24h': 0,
-            'positive_count_24h': 0, 'negative_count_24h': 0,
-            'sentiment_std_24h': 0.0
-        }
+        print(f"[warn] Could not read news metrics for {symbol}: {e}")
+        items = []
+
+    # Decode straight from the wire strings, one vectorized parse per column (no Decimal round trip);
+    # absent or malformed values fall back to the default per row. Then scatter into the date-aligned outputs
+    idx = pd.Index([raw['ticker_date']['S'] for raw in items], dtype=object).get_indexer(pks) # -1 where no item
+    hit = idx >= 0
+    columns = {}
+    for col, attr in NEWS_METRIC_ATTRS.items():
+        default = NEWS_METRIC_DEFAULTS[col]
+        values = (pd.to_numeric(pd.Series([_wire_text(raw.get(attr)) for raw in items], dtype=object), errors='coerce')
+                  .fillna(default).to_numpy().astype(type(default)))
+        out = np.full(len(pks), default, dtype=type(default))
+        out[hit] = values[idx[hit]]
+        columns[col] = out
+    return columns
+
+def _gain_loss(close):
+    """Branchless per-day gain/loss (first day and NaN deltas count as 0, as in the diff/where form)."""
+    delta = np.diff(close, prepend=close[:1])
+    return np.fmax(delta, 0.0), np.fmax(-delta, 0.0) # fmax drops NaN in favour of 0
+
+@njit(inline='always')
+def _rsi_loop(gains, losses, period):
+    """
+    Single-pass RSI with simple (SMA) averages: same values as rolling(period, min_periods=1).mean()
+    of gains/losses, with a zero average loss replaced by 1e-9.
+    """
+    n = gains.shape[0]
+    rsi = np.empty(n)
+    sum_gain = 0.0; sum_loss = 0.0
+    nz_gain = 0; nz_loss = 0 # Non-zero entries in the window: an all-zero window snaps its sum to exactly 0
+    for i in range(n):
+        sum_gain += gains[i]; sum_loss += losses[i]
+        nz_gain += gains[i] != 0.0; nz_loss += losses[i] != 0.0
+        if i >= period:
+            sum_gain -= gains[i - period]; sum_loss -= losses[i - period]
+            nz_gain -= gains[i - period] != 0.0; nz_loss -= losses[i - period] != 0.0
+        if nz_gain == 0: sum_gain = 0.0
+        if nz_loss == 0: sum_loss = 0.0
+        count = min(i + 1, period)
+        avg_gain = sum_gain / count
+        avg_loss = sum_loss / count
+        if avg_loss <= 0.0: avg_loss = 1e-9
+        rsi[i] = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    return rsi
+
+@njit(inline='always')
+def _rolling_mean_into(x, out, window):
+    """
+    rolling(window, min_periods=1).mean() via add-new/subtract-old sums. The window counts its
+    non-NaN values: NaNs are skipped and an empty window gives NaN.
+    """
+    total = 0.0; count = 0
+    for i in range(x.shape[0]):
+        v = x[i]
+        if v == v: total += v; count += 1
+        if i >= window:
+            old = x[i - window]
+            if old == old: total -= old; count -= 1
+        if count == 0: total = 0.0
+        out[i] = total / count if count > 0 else np.nan
+
+# --- Per-window kernels: each bakes its window in as a literal, so the inlined loop is compiled
+# (and cached) specialised to that size ---
+@njit(cache=True)
+def _rsi_14(gains, losses):
+    return _rsi_loop(gains, losses, 14)
+
+@njit(cache=True, error_model='numpy')
+def _abn_volume_30d(volume, out):
+    """Volume over its 30d mean."""
+    _rolling_mean_into(volume, out, 30)
+    for i in range(volume.shape[0]): out[i] = volume[i] / out[i]
+
+@njit(cache=True)
+def _volatility_20d(ret, out):
+    """20d sample std (ddof=1) of returns, NaNs skipped; fewer than 2 values gives NaN."""
+    total = 0.0; total_sq = 0.0; count = 0
+    for i in range(ret.shape[0]):
+        x = ret[i]
+        if x == x: total += x; total_sq += x * x; count += 1
+        if i >= 20:
+            old = ret[i - 20]
+            if old == old: total -= old; total_sq -= old * old; count -= 1
+        if count == 0: total = 0.0; total_sq = 0.0
+        if count >= 2:
+            var = (total_sq - total * total / count) / (count - 1)
+            out[i] = np.sqrt(var) if var > 0 else 0.0
+        else: out[i] = np.nan
+
+@njit(cache=True)
+def _ma_50d(close, out):
+    _rolling_mean_into(close, out, 50)
+
+@njit(cache=True)
+def _ma_200d(close, out):
+    _rolling_mean_into(close, out, 200)
+
+@njit(cache=True)
+def _mean_3d(sent, out):
+    _rolling_mean_into(sent, out, 3)
+
+def _rolling_features(close, volume, ret, sent):
+    """Runs the per-window kernels over contiguous float64 arrays. Returns (abn_volume, vol_20d, ma_50d, ma_200d, sent_3d)."""
+    outs = tuple(np.empty(close.shape[0]) for _ in range(5))
+    _abn_volume_30d(volume, outs[0])
+    _volatility_20d(ret, outs[1])
+    _ma_50d(close, outs[2])
+    _ma_200d(close, outs[3])
+    _mean_3d(sent, outs[4])
+    return outs
 
 def create_features(symbol):
     """
@@ -59,53 +202,40 @@ def create_features(symbol):
     df['date'] = pd.to_datetime(df['date'])
     df = df.sort_values("date")
 
-    # --- 1. Price/Volume/Time Features ---
+    # --- 1. Fetch Detailed News Metrics from DynamoDB (first: the rolling kernels need sentiment) ---
+    print(f"Enriching {symbol} data with detailed news metrics from DynamoDB...")
+    date_isos = df['date'].dt.strftime('%Y-%m-%d')
+    news_cols = read_news_metrics_from_dynamodb(symbol, date_isos) # ~N/100 round trips instead of N; float64 sentiment, int64 counts
+
+    # --- 2. Price/Volume/Time Features ---
     df["ret_1d"] = df["close"].pct_change(1)
     df["mom_5d"] = df["close"].pct_change(5)
-    delta = df["close"].diff()
-    gain = np.where(delta > 0, delta, 0.0)
-    loss = np.where(delta < 0, -delta, 0.0)
-    avg_gain = pd.Series(gain).rolling(14, min_periods=1).mean()
-    avg_loss = pd.Series(loss).rolling(14, min_periods=1).mean().replace(0, 1e-9)
-    rs = avg_gain / avg_loss
-    df["rsi_14"] = 100 - (100 / (1 + rs))
-    df["abn_volume"] = df["volume"] / df["volume"].rolling(30, min_periods=1).mean()
+    df["rsi_14"] = _rsi_14(*_gain_loss(df["close"].to_numpy(dtype=np.float64)))
+    # Rolling windows: one specialised kernel each over contiguous float64 arrays
+    ret_1d = np.ascontiguousarray(df['ret_1d'].to_numpy(dtype=np.float64))
+    abn_volume, volatility_20d, ma_50d, ma_200d, avg_sentiment_3d = _rolling_features(
+        np.ascontiguousarray(df['close'].to_numpy(dtype=np.float64)),
+        np.ascontiguousarray(df['volume'].to_numpy(dtype=np.float64)),
+        ret_1d,
+        news_cols['avg_sentiment_24h']
+    )
+    df["abn_volume"] = abn_volume
     df['symbol'] = symbol
     df['ret_lag_1d'] = df['ret_1d'].shift(1)
-    df['volatility_20d'] = df['ret_1d'].rolling(20, min_periods=1).std()
-    df['ma_50d'] = df['close'].rolling(50, min_periods=1).mean()
-    df['ma_200d'] = df['close'].rolling(200, min_periods=1).mean()
-    df['ma_trend_signal'] = (df['ma_50d'] > df['ma_200d']).astype(int)
+    df['volatility_20d'] = volatility_20d
+    df['ma_50d'] = ma_50d
+    df['ma_200d'] = ma_200d
+    df['ma_trend_signal'] = (ma_50d > ma_200d).view(np.int8) # Straight off the kernel outputs (NaN compares False)
     df['day_of_week'] = df['date'].dt.dayofweek
     df['month_of_year'] = df['date'].dt.month
-    if 'abn_volume' in df.columns: df['return_x_volume'] = df['ret_1d'] * df['abn_volume']
-    else: df['return_x_volume'] = 0.0
+    df['return_x_volume'] = ret_1d * abn_volume
 
-    # --- 2. Enrich with Detailed News Metrics from DynamoDB ---
-    print(f"Enriching {symbol} data with detailed news metrics from DynamoDB...")
-    df['date_iso'] = df['date'].dt.strftime('%Y-%m-%d')
-    news_data = df.apply(lambda row: read_news_metrics_from_dynamodb(symbol, row['date_iso']), axis=1)
-    news_df = pd.json_normalize(news_data) # Creates columns for all metrics
-
-    df = pd.concat([df.reset_index(drop=True), news_df], axis=1)
-    df = df.drop(columns=['date_iso'])
-
-    # --- CHANGE 2: Ensure ALL new columns exist and fill NaNs (mostly handled by defaults) ---
-    news_cols = ['avg_sentiment_24h', 'news_count_24h', 'positive_count_24h', 'negative_count_24h', 'sentiment_std_24h']
-    for col in news_cols:
-        if col not in df.columns:
-            df[col] = 0.0 if 'sentiment' in col else 0 # Default sentiment to 0.0, counts to 0
-        else:
-            # Fill any potential NaNs from merge issues, although defaults should prevent this
-             df[col] = df[col].fillna(0.0 if 'sentiment' in col else 0)
-
-    # Convert counts to integer
-    for col in ['news_count_24h', 'positive_count_24h', 'negative_count_24h']:
-         df[col] = df[col].astype(int)
-
-    # --- CHANGE 3: Calculate Rolling Sentiment Average ---
-    # Calculate rolling average AFTER fetching daily data
-    df['avg_sentiment_3d'] = df['avg_sentiment_24h'].rolling(3, min_periods=1).mean()
+    # --- 2b. Attach News Metrics (fetched in step 1; defaults already fill missing days, counts are int) ---
+    df = df.reset_index(drop=True)
+    for col, values in news_cols.items(): df[col] = values
+
+    # --- CHANGE 3: Rolling Sentiment Average (computed by the rolling kernels) ---
+    df['avg_sentiment_3d'] = avg_sentiment_3d
 
 
     # --- 3. Filter for the last 3 years ---
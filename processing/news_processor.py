@@ -1,41 +1,87 @@
 import os
 import json
+import time
 import argparse
+import threading
 import pandas as pd
 import numpy as np 
 import boto3
+from boto3.dynamodb.types import TypeSerializer
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date, timedelta, datetime
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 # --- Constants & AWS Clients ---
 LOCAL_INPUT_PATH = "/opt/ml/processing/input/raw-news"
 REGION = os.environ.get("AWS_REGION", "us-east-1")
-
-dynamodb = boto3.resource("dynamodb", region_name=REGION)
-comprehend = boto3.client("comprehend", region_name=REGION)
-table = dynamodb.Table("TradingCopilot") 
-
-def get_sentiment_score(text):
+DDB_TABLE = "TradingCopilot"
+MAX_WORKERS = 8 # (date, symbol) files are independent and I/O-bound; Comprehend calls are paced below
+
+# One session per process; pooled keep-alive connections, adaptive retries
+BOTO_CONFIG = Config(retries={'mode': 'adaptive', 'max_attempts': 10}, max_pool_connections=64, tcp_keepalive=True)
+session = boto3.Session(region_name=REGION)
+ddb_client = session.client("dynamodb", config=BOTO_CONFIG) # Low-level clients are thread-safe (resources are not)
+comprehend = session.client("comprehend", config=BOTO_CONFIG)
+_serializer = TypeSerializer()
+
+COMPREHEND_BATCH_SIZE = 25 # BatchDetectSentiment per-request document limit
+COMPREHEND_MAX_TPS = 10 # BatchDetectSentiment default quota, shared by all worker threads
+_COMPREHEND_PACE_LOCK = threading.Lock()
+_comprehend_next_call = 0.0 # monotonic time the next Comprehend call may start
+SENTIMENT_SCORES = {'POSITIVE': 1.0, 'NEGATIVE': -1.0} # NEUTRAL or MIXED -> 0.0
+SENTIMENT_CACHE_MAX = 50000
+_SENTIMENT_CACHE = OrderedDict() # LRU {truncated title: score} shared across files (syndicated headlines repeat)
+_SENTIMENT_CACHE_LOCK = threading.Lock() # The worker threads share the cache
+
+def _pace_comprehend():
+    """Spaces Comprehend calls across all worker threads so together they stay under COMPREHEND_MAX_TPS."""
+    global _comprehend_next_call
+    with _COMPREHEND_PACE_LOCK:
+        now = time.monotonic()
+        wait = _comprehend_next_call - now
+        _comprehend_next_call = max(now, _comprehend_next_call) + 1.0 / COMPREHEND_MAX_TPS
+    if wait > 0: time.sleep(wait)
+
+def get_sentiment_scores(titles):
     """
-    Analyzes text using Amazon Comprehend and returns a numerical sentiment score.
-    Positive -> 1, Negative -> -1, Neutral/Mixed -> 0
+    Analyzes a list of titles using Amazon Comprehend in batches of 25 and returns
+    a float array, one score per title. Positive -> 1, Negative -> -1, Neutral/Mixed -> 0
+    Each distinct title is sent once; titles already scored by an earlier file come from the cache.
+    Raises if a batch is still throttled after the client's retries, so the file is not written with neutral scores.
     """
-    if not text or not isinstance(text, str): 
-        return 0.0
-    try:
-        # Limit text length for Comprehend 
-        truncated_text = text[:4900] # Comprehend has a 5KB limit
-        response = comprehend.detect_sentiment(Text=truncated_text, LanguageCode='en')
-        sentiment = response['Sentiment']
-        if sentiment == 'POSITIVE': return 1.0
-        elif sentiment == 'NEGATIVE': return -1.0
-        else: return 0.0 # NEUTRAL or MIXED
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'TextSizeLimitExceededException':
-             print(f"    - Comprehend Text Size Limit Exceeded even after truncation for title starting with: {text[:50]}...")
-        return 0.0
-    except Exception as e:
-        return 0.0
+    scores = np.zeros(len(titles)) # Non-string titles are never sent and stay 0.0
+    positions = [i for i, t in enumerate(titles) if isinstance(t, str)]
+    # Limit text length for Comprehend (5KB per document)
+    texts = [titles[i].encode('utf-8')[:4900].decode('utf-8', 'ignore') for i in positions]
+    known = {} # Scores for this call: cache hits, then fresh Comprehend results
+    with _SENTIMENT_CACHE_LOCK:
+        for t in dict.fromkeys(texts):
+            if t in _SENTIMENT_CACHE:
+                _SENTIMENT_CACHE.move_to_end(t)
+                known[t] = _SENTIMENT_CACHE[t]
+    pending = [t for t in dict.fromkeys(texts) if t not in known]
+    fetched = {}
+    for start in range(0, len(pending), COMPREHEND_BATCH_SIZE):
+        batch = pending[start:start + COMPREHEND_BATCH_SIZE]
+        _pace_comprehend()
+        try:
+            response = comprehend.batch_detect_sentiment(TextList=batch, LanguageCode='en')
+            for result in response.get('ResultList', []):
+                fetched[batch[result['Index']]] = SENTIMENT_SCORES.get(result['Sentiment'], 0.0)
+            for error in response.get('ErrorList', []): # Failed documents stay neutral (and uncached)
+                print(f"    - Comprehend error {error.get('ErrorCode')} for title starting with: {batch[error['Index']][:50]}...")
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ThrottlingException': raise # Adaptive retries exhausted: fail the file, don't fake neutral
+            print(f"    - Comprehend batch failed ({e.response['Error']['Code']}), scoring {len(batch)} titles neutral")
+    with _SENTIMENT_CACHE_LOCK:
+        for t, score in fetched.items():
+            _SENTIMENT_CACHE[t] = score
+            if len(_SENTIMENT_CACHE) > SENTIMENT_CACHE_MAX: _SENTIMENT_CACHE.popitem(last=False)
+    known.update(fetched)
+    if positions: scores[positions] = [known.get(t, 0.0) for t in texts]
+    return scores
 
 def process_news_file(symbol, date_iso):
     """
@@ -55,23 +101,16 @@ def process_news_file(symbol, date_iso):
     articles = data.get("articles", [])
     if not articles: return # Skip if no articles in JSON
 
-    # --- Calculate Sentiment & Counts ---
-    sentiment_scores = []
-    positive_count = 0
-    negative_count = 0
-    for article in articles:
-        if article.get("lang") == "English":
-            title = article.get("title", "")
-            if title:
-                score = get_sentiment_score(title)
-                sentiment_scores.append(score)
-                if score > 0: positive_count += 1
-                elif score < 0: negative_count += 1
-
-    # --- Calculate Final Metrics ---
-    avg_sentiment = np.mean(sentiment_scores) if sentiment_scores else 0.0
+    # --- Calculate Sentiment (batched Comprehend calls) ---
+    titles = [article.get("title") for article in articles if article.get("lang") == "English" and article.get("title")]
+    sentiment_scores = get_sentiment_scores(titles)
+
+    # --- Calculate Final Metrics (vectorized over the score array) ---
+    avg_sentiment = sentiment_scores.mean() if sentiment_scores.size else 0.0
     # Calculate standard deviation only if there are 2+ scores
-    sentiment_std = np.std(sentiment_scores) if len(sentiment_scores) >= 2 else 0.0
+    sentiment_std = sentiment_scores.std() if sentiment_scores.size >= 2 else 0.0
+    positive_count = int((sentiment_scores > 0).sum())
+    negative_count = int((sentiment_scores < 0).sum())
     total_article_count = len(articles)
 
     # --- Prepare and write item to DynamoDB ---
@@ -87,7 +126,7 @@ def process_news_file(symbol, date_iso):
     }
 
     try:
-        table.put_item(Item=item_to_write)
+        ddb_client.put_item(TableName=DDB_TABLE, Item={k: _serializer.serialize(v) for k, v in item_to_write.items()})
         # print(f" Wrote detailed metrics for {symbol} on {date_iso}.") # Reduce log noise
     except Exception as e:
         print(f" ERROR writing to DynamoDB for {symbol} on {date_iso}: {e}")
@@ -110,16 +149,20 @@ def main():
 
     print(f"Processing news for {symbols} from {start_date} to {end_date} (detailed metrics)")
 
-    current_date = start_date
+    tasks = [
+        (symbol, (start_date + timedelta(days=n)).strftime("%Y-%m-%d"))
+        for n in range((end_date - start_date).days + 1) for symbol in symbols
+    ]
     processed_count = 0
-    while current_date <= end_date:
-        date_iso = current_date.strftime("%Y-%m-%d")
-        for symbol in symbols:
-            process_news_file(symbol, date_iso)
-            processed_count +=1
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        futures = {ex.submit(process_news_file, symbol, date_iso): (symbol, date_iso) for symbol, date_iso in tasks}
+        for future in as_completed(futures):
+            symbol, date_iso = futures[future]
+            try: future.result()
+            except Exception as e: print(f"  - Error processing {symbol} on {date_iso}: {e}")
+            processed_count += 1
             if processed_count % 100 == 0:
-                 print(f"  Processed {processed_count} potential files (Date: {date_iso}, Symbol: {symbol})...")
-        current_date += timedelta(days=1)
+                 print(f"  Processed {processed_count}/{len(tasks)} potential files (Last: {date_iso}, Symbol: {symbol})...")
 
     print(f"News processing complete. Checked {processed_count} potential files.")
 
@@ -0,0 +1,89 @@
+import time
+import argparse
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from boto3.dynamodb.conditions import Attr
+
+# --- Configuration ---
+REGION = "us-east-1"
+DDB_TABLE = "TradingCopilot"
+HISTORY_INDEX = "TickerDatatypeIndex" # Queried by lambdas/get-history (PK 'ticker', SK 'datatype_sk')
+
+# --- AWS Clients ---
+BOTO_CONFIG = Config(retries={'mode': 'adaptive', 'max_attempts': 10})
+dynamodb = boto3.resource("dynamodb", region_name=REGION, config=BOTO_CONFIG)
+ddb_client = boto3.client("dynamodb", region_name=REGION, config=BOTO_CONFIG)
+
+# --- Create the GSI if the table doesn't have it yet ---
+def ensure_history_index(table_name):
+    desc = ddb_client.describe_table(TableName=table_name)['Table']
+    if any(gsi['IndexName'] == HISTORY_INDEX for gsi in desc.get('GlobalSecondaryIndexes', [])):
+        print(f"GSI {HISTORY_INDEX} already exists.")
+        return
+    create = {
+        'IndexName': HISTORY_INDEX,
+        'KeySchema': [{'AttributeName': 'ticker', 'KeyType': 'HASH'}, {'AttributeName': 'datatype_sk', 'KeyType': 'RANGE'}],
+        'Projection': {'ProjectionType': 'ALL'}
+    }
+    if desc.get('BillingModeSummary', {}).get('BillingMode') != 'PAY_PER_REQUEST': # Provisioned tables need the GSI's own throughput
+        throughput = desc['ProvisionedThroughput']
+        create['ProvisionedThroughput'] = {k: throughput[k] for k in ('ReadCapacityUnits', 'WriteCapacityUnits')}
+    ddb_client.update_table(
+        TableName=table_name,
+        AttributeDefinitions=[{'AttributeName': 'ticker', 'AttributeType': 'S'}, {'AttributeName': 'datatype_sk', 'AttributeType': 'S'}],
+        GlobalSecondaryIndexUpdates=[{'Create': create}]
+    )
+    print(f"Creating GSI {HISTORY_INDEX} (it backfills in the background; items updated below are indexed as it builds)...")
+
+# --- Backfill the GSI key attributes on prediction items written before inference-caller set them ---
+def backfill(table_name, dry_run):
+    """
+    Scans for prediction items without 'datatype_sk' and sets the attributes inference-caller now writes:
+    ticker (from ticker_date) and datatype_sk = 'prediction#' + ingested_at. Safe to re-run.
+    """
+    table = dynamodb.Table(table_name)
+    scan_args = {
+        'FilterExpression': Attr('datatype').eq('prediction') & Attr('datatype_sk').not_exists(),
+        'ProjectionExpression': 'ticker_date, datatype, ingested_at, data_found_for'
+    }
+    updated, skipped = 0, 0
+    while True:
+        response = table.scan(**scan_args)
+        for item in response.get('Items', []):
+            ticker, _, date_iso = item['ticker_date'].rpartition('_') # Dates have no '_'; tickers may
+            ingested_at = item.get('ingested_at') or item.get('data_found_for') or date_iso # Oldest items may lack ingested_at
+            if not ticker or not ingested_at:
+                print(f"  - WARN: Skipping {item['ticker_date']}: cannot derive ticker/ingested_at")
+                skipped += 1; continue
+            if dry_run:
+                print(f"  - Would set ticker={ticker}, datatype_sk=prediction#{ingested_at} on {item['ticker_date']}")
+                updated += 1; continue
+            try:
+                table.update_item(
+                    Key={'ticker_date': item['ticker_date'], 'datatype': 'prediction'},
+                    UpdateExpression='SET ticker = :t, datatype_sk = :sk',
+                    ConditionExpression='attribute_exists(ticker_date) AND attribute_not_exists(datatype_sk)', # Never clobber a newer write
+                    ExpressionAttributeValues={':t': ticker, ':sk': f"prediction#{ingested_at}"}
+                )
+                updated += 1
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException': raise
+                skipped += 1
+        if 'LastEvaluatedKey' not in response: break
+        scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        time.sleep(0.1) # Leave read capacity for the live lambdas
+    print(f"{'Would update' if dry_run else 'Updated'} {updated} prediction items, skipped {skipped}.")
+
+def main():
+    ap = argparse.ArgumentParser(description=f"One-off backfill so existing predictions show up in {HISTORY_INDEX} (get-history).")
+    ap.add_argument("--table", default=DDB_TABLE)
+    ap.add_argument("--create-index", action="store_true", help=f"Create {HISTORY_INDEX} first if it is missing")
+    ap.add_argument("--dry-run", action="store_true", help="Print the updates without writing")
+    args = ap.parse_args()
+
+    if args.create_index: ensure_history_index(args.table)
+    backfill(args.table, args.dry_run)
+
+if __name__ == "__main__":
+    main()
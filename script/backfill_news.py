@@ -1,9 +1,12 @@
 import os
 import json
+import time
 import boto3
+import random
+import asyncio
 import datetime
-import time
 import requests
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 # --- Configuration ---
@@ -11,23 +14,36 @@ S3_BUCKET = "ai-trading-copilot-raw"
 S3_NEWS_PATH = "gdelt/daily/"
 WATCHLIST = ["AAPL", "MSFT", "AMZN"]
 DAYS_TO_BACKFILL = 365 * 3
+GDELT_CONCURRENCY = 8 # Max in-flight GDELT requests
+GDELT_MIN_INTERVAL = 5.0 # GDELT's documented limit: one request per 5 s, across all tasks
+GDELT_MAX_RETRIES = 5 # Retries on a rate-limit answer before giving up on a day
+_gdelt_next_slot = 0.0 # monotonic time the next GDELT request may start
 
 # --- AWS Client ---
-s3_client = boto3.client("s3")
+s3_client = boto3.client("s3", config=Config(retries={'mode': 'adaptive', 'max_attempts': 10}, max_pool_connections=32))
 
-# --- Function to check if file exists in S3 ---
-def file_exists_in_s3(bucket, key):
-    try:
-        s3_client.head_object(Bucket=bucket, Key=key)
-        return True
-    except ClientError as e:
-        if e.response['Error']['Code'] == '404':
-            return False
-        else:
-            raise
+# --- Function to list the files already in S3 under a prefix (one call per date instead of a HEAD per key) ---
+def _list_keys(bucket, prefix):
+    paginator = s3_client.get_paginator("list_objects_v2")
+    return {obj["Key"] for page in paginator.paginate(Bucket=bucket, Prefix=prefix) for obj in page.get("Contents", [])}
+
+async def existing_keys_in_s3(bucket, prefix):
+    return await asyncio.to_thread(_list_keys, bucket, prefix)
+
+# --- Global GDELT pacing (tasks share one event loop, so no lock is needed) ---
+async def wait_for_gdelt_slot():
+    global _gdelt_next_slot
+    now = time.monotonic()
+    wait = _gdelt_next_slot - now
+    _gdelt_next_slot = max(now, _gdelt_next_slot) + GDELT_MIN_INTERVAL
+    if wait > 0: await asyncio.sleep(wait)
+
+def is_gdelt_rate_limited(response):
+    """GDELT rate-limits with HTTP 429 or with a 200 plain-text "Please limit requests..." body."""
+    return response.status_code == 429 or (response.status_code == 200 and "limit requests" in response.text[:200].lower())
 
 # --- Self-Contained Fetcher Function (with User-Agent fix) ---
-def fetch_gdelt_articles(keyword: str, date_obj: datetime.date, max_records: int = 250):
+async def fetch_gdelt_articles(keyword: str, date_obj: datetime.date, sem: asyncio.Semaphore, max_records: int = 250):
     start_datetime = date_obj.strftime("%Y%m%d000000")
     end_datetime = date_obj.strftime("%Y%m%d235959")
     url = (
@@ -43,9 +59,20 @@ def fetch_gdelt_articles(keyword: str, date_obj: datetime.date, max_records: int
     }
     
     try:
-        # Pass the headers with the request
-        response = requests.get(url, timeout=30, headers=headers)
-        
+        # Pass the headers with the request; paced globally, and backs off further when GDELT rate-limits us
+        for attempt in range(GDELT_MAX_RETRIES + 1):
+            async with sem:
+                await wait_for_gdelt_slot()
+                response = await asyncio.to_thread(requests.get, url, timeout=30, headers=headers)
+            if not is_gdelt_rate_limited(response):
+                break
+            if attempt == GDELT_MAX_RETRIES:
+                print(f"    - STILL RATE LIMITED for {keyword} on {date_obj} after {GDELT_MAX_RETRIES} retries. Giving up on this day.")
+                return None
+            delay = min(60.0, 5 * 2 ** attempt) * random.uniform(0.5, 1.5)
+            print(f"    - RATE LIMITED for {keyword} on {date_obj}. Retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+
         if response.status_code != 200 or not response.text:
             return []
 
@@ -66,39 +93,57 @@ def fetch_gdelt_articles(keyword: str, date_obj: datetime.date, max_records: int
         print(f"    - NETWORK ERROR for {keyword} on {date_obj}: {e}")
         return []
 
-# --- Main Execution Logic ---
-if __name__ == "__main__":
-    
-    def daterange(start_date, end_date):
-        for n in range(int((end_date - start_date).days) + 1):
-            yield start_date + datetime.timedelta(n)
+# --- Per (ticker, date) backfill task ---
+async def backfill_one(ticker: str, single_date: datetime.date, sem: asyncio.Semaphore, s3_key: str):
+    date_str = single_date.strftime("%Y-%m-%d")
+    print(f"  - Fetching news for {ticker} on {date_str}...")
+    news_articles = await fetch_gdelt_articles(ticker, single_date, sem)
+
+    if news_articles is None:
+        print(f"    - FETCH FAILED for {ticker} on {date_str} (rate limited). Left for the next run.")
+    elif not news_articles:
+        print(f"    - No articles found for {ticker} on {date_str}. Skipping S3 upload.")
+    else:
+        try:
+            file_content = json.dumps({"articles": news_articles}).encode('utf-8')
+            await asyncio.to_thread(s3_client.put_object, Bucket=S3_BUCKET, Key=s3_key, Body=file_content)
+            print(f"    - Success! Uploaded {len(news_articles)} articles for {ticker} on {date_str}.")
+        except Exception as e:
+            print(f"UPLOAD ERROR for {ticker} on {date_str}: {e}")
+
+# --- Per date: one listing, then fetch only the missing tickers ---
+async def backfill_date(single_date: datetime.date, sem: asyncio.Semaphore):
+    date_str = single_date.strftime("%Y-%m-%d")
+    prefix = f"{S3_NEWS_PATH}{date_str}/"
+    try:
+        existing = await existing_keys_in_s3(S3_BUCKET, prefix)
+    except ClientError as e:
+        print(f"  - LIST ERROR for {date_str}: {e}. Skipping date.")
+        return
 
+    tasks = []
+    for ticker in WATCHLIST:
+        s3_key = f"{prefix}{ticker}.json"
+        if s3_key in existing:
+            print(f"  - File for {ticker} on {date_str} already exists. Skipping.")
+        else:
+            tasks.append(backfill_one(ticker, single_date, sem, s3_key))
+    await asyncio.gather(*tasks)
+
+async def main():
     end_date = datetime.date.today()
     start_date = end_date - datetime.timedelta(days=DAYS_TO_BACKFILL)
 
     print(f"Starting FINAL backfill for {WATCHLIST} from {start_date} to {end_date}...")
 
-    for single_date in daterange(start_date, end_date):
-        date_str = single_date.strftime("%Y-%m-%d")
-        for ticker in WATCHLIST:
-            s3_key = f"{S3_NEWS_PATH}{date_str}/{ticker}.json"
-            if file_exists_in_s3(S3_BUCKET, s3_key):
-                print(f"  - File for {ticker} on {date_str} already exists. Skipping.")
-                continue
-
-            print(f"  - Fetching news for {ticker} on {date_str}...")
-            news_articles = fetch_gdelt_articles(ticker, single_date)
-            
-            if not news_articles:
-                print(f"    - No articles found. Skipping S3 upload.")
-            else:
-                try:
-                    file_content = json.dumps({"articles": news_articles}).encode('utf-8')
-                    s3_client.put_object(Bucket=S3_BUCKET, Key=s3_key, Body=file_content)
-                    print(f"    - Success! Uploaded {len(news_articles)} articles.")
-                except Exception as e:
-                    print(f"UPLOAD ERROR for {ticker} on {date_str}: {e}")
-
-            time.sleep(5) 
-
-    print("Backfill complete!")
\ No newline at end of file
+    sem = asyncio.Semaphore(GDELT_CONCURRENCY)
+    await asyncio.gather(*(
+        backfill_date(start_date + datetime.timedelta(n), sem)
+        for n in range((end_date - start_date).days + 1)
+    ))
+
+    print("Backfill complete!")
+
+# --- Main Execution Logic ---
+if __name__ == "__main__":
+    asyncio.run(main())
\ No newline at end of file
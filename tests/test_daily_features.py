@@ -0,0 +1,73 @@
+import os
+import importlib.util
+import numpy as np
+import pandas as pd
+import pytest
+
+# The lambda reads its config at import time; no AWS call is made until a handler runs
+for key, value in {'RAW_BUCKET': 'raw', 'CURATED_BUCKET': 'curated', 'DDB_TABLE': 'TradingCopilot', 'AWS_DEFAULT_REGION': 'us-east-1'}.items():
+    os.environ.setdefault(key, value)
+_SPEC = importlib.util.spec_from_file_location(
+    'daily_feature_engineer', os.path.join(os.path.dirname(__file__), '..', 'lambdas', 'daily-feature-engineer.py')
+)
+dfe = importlib.util.module_from_spec(_SPEC)
+_SPEC.loader.exec_module(dfe)
+
+# Per-feature (rtol, atol) of the float32 kernel vs the float64 pandas reference. Returns are a
+# difference of two float32-rounded closes, so near zero only an absolute bound is meaningful.
+TOLERANCES = {
+    'ret_1d': (0, 5e-7), 'mom_5d': (0, 5e-7), 'ret_lag_1d': (0, 5e-7), 'return_x_volume': (0, 1e-6),
+    'rsi_14': (0, 1e-3), 'abn_volume': (1e-6, 0), 'volatility_20d': (0, 2e-7),
+    'ma_50d': (1e-6, 0), 'ma_200d': (1e-6, 0), 'ma_trend_signal': (0, 0), 'avg_sentiment_3d': (0, 2e-7)
+}
+
+
+def pandas_reference(close, volume, sent):
+    """The float64 pandas feature code the kernel replaced (same formulas as processing/feature_builder.py)."""
+    df = pd.DataFrame({'close': close, 'volume': volume, 'avg_sentiment_24h': sent})
+    df["ret_1d"] = df["close"].pct_change(1); df["mom_5d"] = df["close"].pct_change(5)
+    delta = df["close"].diff(); gain = np.where(delta > 0, delta, 0.0); loss = np.where(delta < 0, -delta, 0.0)
+    avg_gain = pd.Series(gain).rolling(14, min_periods=1).mean(); avg_loss = pd.Series(loss).rolling(14, min_periods=1).mean().replace(0, 1e-9)
+    rs = avg_gain / avg_loss; df["rsi_14"] = 100 - (100 / (1 + rs))
+    df["abn_volume"] = df["volume"] / df["volume"].rolling(30, min_periods=1).mean()
+    df['ret_lag_1d'] = df['ret_1d'].shift(1); df['volatility_20d'] = df['ret_1d'].rolling(20, min_periods=1).std()
+    df['ma_50d'] = df['close'].rolling(50, min_periods=1).mean(); df['ma_200d'] = df['close'].rolling(200, min_periods=1).mean()
+    df['ma_trend_signal'] = (df['ma_50d'] > df['ma_200d']).astype(int)
+    df['return_x_volume'] = df['ret_1d'] * df['abn_volume']
+    df['avg_sentiment_3d'] = df['avg_sentiment_24h'].rolling(3, min_periods=1).mean()
+    return df
+
+
+def run_kernel(close, volume, sent):
+    out = np.empty((len(close), len(dfe.KERNEL_FEATURE_COLS)), dtype=np.float32)
+    dfe.compute_features(close.astype(np.float32), volume.astype(np.float32), sent.astype(np.float32), out)
+    return out
+
+
+def synthetic_series(n, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    return close, rng.uniform(1e5, 1e6, n), rng.uniform(-1, 1, n)
+
+
+def test_nan_gaps_and_zero_volume_match_pandas():
+    close, volume, sent = synthetic_series(400)
+    close[100] = np.nan; close[300:303] = np.nan; volume[150] = np.nan
+    volume[200:240] = 0.0 # Whole 30d window at zero volume: 0/0
+    ref = pandas_reference(close, volume, sent)
+    out = run_kernel(close, volume, sent)
+    for j, col in enumerate(dfe.KERNEL_FEATURE_COLS):
+        expected = ref[col].to_numpy(dtype=np.float64)
+        np.testing.assert_array_equal(np.isnan(out[:, j]), np.isnan(expected), err_msg=col)
+        np.testing.assert_allclose(out[:, j], expected, rtol=1e-3, atol=1e-4, equal_nan=True, err_msg=col)
+    assert np.isfinite(out[-1]).all() # Rows after the gaps are valid again
+
+
+@pytest.mark.parametrize('n', [250, 20000]) # The lambda's lookback, and a long series to catch drift in the running sums
+def test_float32_kernel_within_tolerance_of_float64_pandas(n):
+    close, volume, sent = synthetic_series(n, seed=n)
+    ref = pandas_reference(close, volume, sent)
+    out = run_kernel(close, volume, sent)
+    for j, col in enumerate(dfe.KERNEL_FEATURE_COLS):
+        rtol, atol = TOLERANCES[col]
+        np.testing.assert_allclose(out[:, j], ref[col].to_numpy(dtype=np.float64), rtol=rtol, atol=atol, equal_nan=True, err_msg=col)